@@ -35,6 +35,8 @@ class SuperUserPermission(BasePermission):
                 or request.path.startswith("/api/members")
                 or request.path.startswith("/api/payments")
                 or request.path.startswith("/api/checks")
+                or request.path.startswith("/api/archives")
+                or request.path.startswith("/api/announcements")
             ):
                 return True
             if request.method != "PUT" and request.path.startswith("/api/members/"):
@@ -223,9 +223,9 @@ class UserCreateSerializer(UserBaseSerializer):
     @transaction.atomic
     def save(self, **kwargs: User) -> User:
         user: User = super().save(**kwargs)
-        if Season.objects.filter(is_current=True).exists():
-            payment = Payment(user=user, season=Season.objects.get(is_current=True))
-            payment.save()
+        current_season = Season.objects.current()
+        if current_season:
+            Payment(user=user, season=current_season).save()
         return user
 
 
@@ -86,6 +86,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "members.caching.RequestCacheMiddleware",
+    "members.emails.EmailDigestMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -135,6 +137,9 @@ EMAIL_USE_TLS = False
 EMAIL_USE_SSL = True
 EMAIL_TIMEOUT = 10
 DEFAULT_FROM_EMAIL = f"Tech K'Dance <{os.getenv('EMAIL_HOST_USER')}>"
+# Emails are stored on commit and sent by the send_outbox command, run by the
+# outbox service of docker-compose. Set to False to send them from the requests.
+EMAIL_OUTBOX = True
 
 # Password and auth
 AUTH_PASSWORD_VALIDATORS = [
@@ -180,6 +185,17 @@ CAWL_URL = os.getenv("CAWL_URL")
 
 # Other
 DATE_FORMAT = "%Y-%m-%d"
+# Where expired seasons are archived before being deleted
+SEASON_ARCHIVE_DIR = os.getenv("SEASON_ARCHIVE_DIR", BASE_DIR / "archives")
+# Settings and current season are cached per process and per request. Saving
+# them clears the cache, the timeout bounds staleness across processes when
+# the cache backend is not shared.
+CURRENT_CACHE_TIMEOUT = 60
+# Announcements are sent by the send_announcements worker only, run by the
+# announcements service of docker-compose. A single worker keeps all of them
+# within the budget, so the SMTP provider does not block us.
+ANNOUNCEMENT_BATCH_SIZE = 20
+ANNOUNCEMENT_PER_MINUTE = 30
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "accounts.api.permissions.SuperUserPermission",
@@ -16,6 +16,9 @@ You should have received a copy of the GNU Affero General Public License along
 with KDance registration. If not, see <https://www.gnu.org/licenses/>.
 """
 
+import os
+import tempfile
+
 from .settings import *  # noqa: F403
 
 
@@ -23,7 +26,14 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",  # noqa: F405
+        # A file, not the shared in-memory database that locks whole tables:
+        # concurrent writers wait for each other as in production
+        "OPTIONS": {"timeout": 30},
+        "TEST": {"NAME": os.path.join(tempfile.gettempdir(), "kdance-test.sqlite3")},
     }
 }
 
 EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+
+EMAIL_OUTBOX = False
+SEASON_ARCHIVE_DIR = tempfile.mkdtemp(prefix="kdance-archives-")
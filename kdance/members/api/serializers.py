@@ -24,7 +24,7 @@ from typing import Any
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import transaction
+from django.db import models, transaction
 from django.db.utils import IntegrityError
 from django.utils import timezone
 from drf_writable_nested.serializers import WritableNestedModelSerializer
@@ -33,6 +33,8 @@ from rest_framework import serializers
 from members.emails import EmailEnum, EmailSender
 from members.models import (
     Ancv,
+    Announcement,
+    AnnouncementRecipient,
     Check,
     Contact,
     Course,
@@ -41,6 +43,8 @@ from members.models import (
     Member,
     OtherPayment,
     Payment,
+    PaymentBalance,
+    PaymentQuerySet,
     Season,
     SportCoupon,
     SportPass,
@@ -52,6 +56,40 @@ from members.models import (
 _logger = logging.getLogger(__name__)
 
 
+def parse_fields(value: str) -> dict:
+    """Turn "id,payment.due" into the tree {"id": {}, "payment": {"due": {}}}."""
+    tree: dict = {}
+    for path in value.split(","):
+        node = tree
+        for name in filter(None, (name.strip() for name in path.split("."))):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def prune_fields(
+    serializer: serializers.Field, fields: dict | None, exclude: dict
+) -> None:
+    """Drop from serializer the fields not in `fields` or leaves of `exclude`.
+
+    An empty subtree in `fields` keeps the nested serializer whole. Pruning happens
+    before any evaluation, so dropped fields cost no query.
+    """
+    if isinstance(serializer, serializers.ListSerializer) and serializer.child:
+        serializer = serializer.child
+    if not isinstance(serializer, serializers.Serializer):
+        return
+    for name in list(serializer.fields):
+        excluded = exclude.get(name)
+        if (fields is not None and name not in fields) or excluded == {}:
+            serializer.fields.pop(name)
+        elif (fields and fields[name]) or excluded:
+            prune_fields(
+                serializer.fields[name],
+                fields[name] or None if fields else None,
+                excluded or {},
+            )
+
+
 class GeneralSettingsSerializer(serializers.ModelSerializer):
     class Meta:
         model = GeneralSettings
@@ -174,6 +212,8 @@ class CourseRetrieveSerializer(CourseSerializer):
 class CourseCopySeasonSerializer(serializers.Serializer):
     from_season = serializers.IntegerField(required=True)
     to_season = serializers.IntegerField(required=True)
+    price_increase = serializers.IntegerField(required=False, min_value=0, default=0)
+    capacity = serializers.IntegerField(required=False, min_value=0, allow_null=True)
 
     @staticmethod
     def validate_from_season(season_id: int) -> int:
@@ -188,6 +228,46 @@ class CourseCopySeasonSerializer(serializers.Serializer):
         return season_id
 
 
+class AnnouncementSerializer(serializers.ModelSerializer):
+    pending = serializers.IntegerField(read_only=True)
+    sent = serializers.IntegerField(read_only=True)
+    failed = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Announcement
+        fields = (
+            "id",
+            "season",
+            "course",
+            "teacher",
+            "subject",
+            "message",
+            "status",
+            "created",
+            "pending",
+            "sent",
+            "failed",
+        )
+        read_only_fields = ("status", "created")
+
+    def validate(self, attr: dict) -> dict:
+        validated = super().validate(attr)
+        if (
+            validated.get("course")
+            and validated["course"].season != validated["season"]
+        ):
+            raise serializers.ValidationError(
+                {"course": ["Ce cours n'appartient pas à cette saison."]}
+            )
+        return validated
+
+
+class AnnouncementRecipientSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AnnouncementRecipient
+        fields = ("email", "status", "error", "sent")
+
+
 class DocumentsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Documents
@@ -285,6 +365,37 @@ class CheckSerializer(serializers.ModelSerializer):
         )
 
 
+class PaymentListSerializer(serializers.ListSerializer):
+    def to_representation(self, data) -> list:
+        # Only load the relations of the fields left after pruning
+        child: PaymentSerializer = self.child  # type: ignore[assignment]
+        relations = {str(field.source).split(".")[0] for field in child.fields.values()}
+        if "ledger" in relations:
+            relations.add("payment_balance")
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        if isinstance(iterable, PaymentQuerySet):
+            iterable = (
+                iterable.select_related(None)
+                .prefetch_related(None)
+                .with_details(relations)
+            )
+        payments = list(iterable)
+        # Compute missing balances all at once
+        missing = [
+            payment
+            for payment in payments
+            if "ledger" in relations and not hasattr(payment, "payment_balance")
+        ]
+        if missing:
+            balances = PaymentBalance.objects.refresh(
+                Payment.objects.filter(pk__in=[payment.pk for payment in missing])
+            )
+            by_payment = {balance.payment_id: balance for balance in balances}
+            for payment in missing:
+                payment.payment_balance = by_payment[payment.pk]
+        return super().to_representation(payments)
+
+
 class PaymentSerializer(WritableNestedModelSerializer, serializers.ModelSerializer):
     season = SeasonSerializer()
     ancv = AncvSerializer(required=False)
@@ -296,6 +407,21 @@ class PaymentSerializer(WritableNestedModelSerializer, serializers.ModelSerializ
         read_only=True,
         source="user.username",
     )
+    paid = serializers.FloatField(read_only=True, source="ledger.paid")
+    due = serializers.IntegerField(read_only=True, source="ledger.due")
+    due_detail = serializers.ListField(
+        read_only=True,
+        source="ledger.due_detail",
+        child=serializers.CharField(),
+    )
+    sport_pass_count = serializers.IntegerField(
+        read_only=True,
+        source="ledger.sport_pass_count",
+    )
+    sport_pass_amount = serializers.IntegerField(
+        read_only=True,
+        source="ledger.sport_pass_amount",
+    )
 
     class Meta:
         model = Payment
@@ -318,6 +444,7 @@ class PaymentSerializer(WritableNestedModelSerializer, serializers.ModelSerializ
             "sport_pass_count",
             "sport_pass_amount",
         )
+        list_serializer_class = PaymentListSerializer
 
     def validate(self, attr: dict) -> dict:
         if not attr.get("other_payment", {}).get("comment", "") and not attr.get(
@@ -326,16 +453,44 @@ class PaymentSerializer(WritableNestedModelSerializer, serializers.ModelSerializ
             attr.pop("other_payment", None)
         return super().validate(attr)
 
+    @staticmethod
+    def _sync_checks(payment: Payment, checks_data: list[dict]) -> None:
+        """Apply sent checks as a diff, matching them on (number, bank, month)."""
+        existing: dict[tuple, list[Check]] = {}
+        for check in payment.check_payment.all():
+            existing.setdefault((check.number, check.bank, check.month), []).append(
+                check
+            )
+        to_create = []
+        to_update = []
+        for check_data in checks_data:
+            check_data.pop("payment", None)
+            key = (check_data["number"], check_data["bank"], check_data["month"])
+            matches = existing.get(key)
+            if not matches:
+                to_create.append(Check(payment=payment, **check_data))
+                continue
+            check = matches.pop(0)
+            if (check.amount, check.name) != (check_data["amount"], check_data["name"]):
+                check.amount = check_data["amount"]
+                check.name = check_data["name"]
+                to_update.append(check)
+        to_delete = [check.pk for checks in existing.values() for check in checks]
+        if to_delete:
+            Check.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            Check.objects.bulk_update(to_update, ["amount", "name"])
+        if to_create:
+            Check.objects.bulk_create(to_create)
+
     @transaction.atomic
     def save(self, **kwargs: Payment):
-        checks_data = self.validated_data.pop("check_payment", [])
-        payment = super().save(**kwargs)
-        if checks_data:
-            for check in payment.check_payment.all():
-                check.delete()
-        for check_payment in checks_data:
-            Check(payment=payment, **check_payment).save()
-        payment.save()  # Ewww... but to validate members
+        checks_data = self.validated_data.pop("check_payment", None)
+        with PaymentBalance.objects.deferring():
+            payment = super().save(**kwargs)
+            if checks_data is not None:
+                self._sync_checks(payment, checks_data)
+            payment.save()  # Ewww... but to validate members
 
 
 class PaymentShortSerializer(PaymentSerializer):
@@ -350,6 +505,10 @@ class PaymentShortSerializer(PaymentSerializer):
         )
 
 
+class PaymentNormalizedSerializer(PaymentSerializer):
+    season = serializers.PrimaryKeyRelatedField(read_only=True)  # type: ignore[assignment]
+
+
 class SportPassSerializer(serializers.ModelSerializer):
     class Meta:
         model = SportPass
@@ -484,41 +643,28 @@ class MemberSerializer(WritableNestedModelSerializer, serializers.ModelSerialize
                 sport_pass_item = SportPass.objects.get(member__id=member.id)
                 sport_pass_item.delete()
         courses_removed = []
-        courses_added_active = []
-        courses_added_waiting = []
+        courses_added_active: list[Course] = []
+        courses_added_waiting: list[Course] = []
         if active_courses is not None:
             active_to_remove = [
                 c for c in member.active_courses.all() if c not in active_courses
             ]
-            active_to_add = [
+            to_add = [
                 c
                 for c in active_courses
-                if c not in member.active_courses.all() and not c.is_complete
+                if c not in member.active_courses.all()
+                and c not in member.waiting_courses.all()
             ]
-            courses_added_active = active_to_add
             courses_removed += active_to_remove
-            for course in active_to_add:
-                member.active_courses.add(course)
             for course in active_to_remove:
                 member.active_courses.remove(course)
             waiting_to_remove = [
                 c for c in member.waiting_courses.all() if c not in active_courses
             ]
-            waiting_to_add = [
-                c
-                for c in active_courses
-                if c.is_complete
-                and c not in member.waiting_courses.all()
-                and c not in member.active_courses.all()
-            ]
-            courses_added_waiting = waiting_to_add
             courses_removed += waiting_to_remove
-            for course in waiting_to_add:
-                member.waiting_courses.add(course)
-                if not WaitingList.objects.filter(
-                    course=course, member=member
-                ).exists():
-                    WaitingList(course=course, member=member).save()
+            courses_added_active, courses_added_waiting = Course.objects.reserve_seats(
+                member, to_add
+            )
             for course in waiting_to_remove:
                 member.waiting_courses.remove(course)
                 waiting_list = WaitingList.objects.filter(
@@ -539,7 +685,6 @@ class MemberSerializer(WritableNestedModelSerializer, serializers.ModelSerialize
             member.cancelled_courses.clear()
             for course in cancelled_courses:
                 member.cancelled_courses.add(course)
-        Course.objects.manage_waiting_lists()
         if member.created < now and (
             courses_removed or courses_added_active or courses_added_waiting
         ):  # It's edition, not creation
@@ -582,6 +727,19 @@ class MemberRetrieveShortSerializer(MemberRetrieveSerializer):
         )
 
 
+class MemberNormalizedSerializer(MemberSerializer):
+    """Courses and season as ids, their details are side-loaded by the view."""
+
+    payment = PaymentNormalizedSerializer(required=False, read_only=True)
+
+
+class MemberNormalizedShortSerializer(MemberSerializer):
+    payment = PaymentShortSerializer(required=False, read_only=True)
+
+    class Meta(MemberRetrieveShortSerializer.Meta):
+        pass
+
+
 class MemberCoursesActionsEnum(Enum):
     ADD = "add"
     FORCE_ADD = "force_add"  # Bypass waiting list
@@ -627,23 +785,9 @@ class MemberCoursesSerializer(serializers.Serializer):
     @transaction.atomic
     def save(self, **kwargs: Any) -> None:
         if self._action == MemberCoursesActionsEnum.ADD:
-            active_courses = [
-                course
-                for course in self.validated_data.get("courses", [])
-                if not course.is_complete
-            ]
-            waiting_courses = [
-                course
-                for course in self.validated_data.get("courses", [])
-                if course.is_complete
-            ]
-            self._member.active_courses.add(*active_courses)
-            self._member.waiting_courses.add(*waiting_courses)
-            for course in waiting_courses:
-                if not WaitingList.objects.filter(
-                    course=course, member=self._member
-                ).exists():
-                    WaitingList(course=course, member=self._member).save()
+            active_courses, waiting_courses = Course.objects.reserve_seats(
+                self._member, self.validated_data.get("courses", [])
+            )
             self._member.cancelled_courses.remove(*active_courses, *waiting_courses)
             self._member.save()
         elif self._action == MemberCoursesActionsEnum.FORCE_ADD:
@@ -667,21 +811,24 @@ class MemberCoursesSerializer(serializers.Serializer):
                     )
             self._member.cancelled_courses.remove(*active_courses)
             self._member.save()
-            email_sender = EmailSender(EmailEnum.WAITING_TO_ACTIVE_COURSE)
-            for course in active_courses:
-                email_sender.send_email(
-                    emails=[
+            EmailSender(EmailEnum.WAITING_TO_ACTIVE_COURSE).send_emails(
+                (
+                    [
                         self._member.email,
                         self._member.user.username,
                         settings.SUPERUSER_EMAIL,
                     ],
-                    full_name=f"{self._member.first_name} {self._member.last_name}",
-                    course_name=course.name,
-                    weekday=course.get_weekday_display(),
-                    with_next_course_warning=course.season.signup_end
-                    and course.season.signup_end < date.today(),
-                    start_hour=course.start_hour.strftime("%Hh%M"),
+                    {
+                        "full_name": f"{self._member.first_name} {self._member.last_name}",
+                        "course_name": course.name,
+                        "weekday": course.get_weekday_display(),
+                        "with_next_course_warning": course.season.signup_end
+                        and course.season.signup_end < date.today(),
+                        "start_hour": course.start_hour.strftime("%Hh%M"),
+                    },
                 )
+                for course in active_courses
+            )
         elif self._action == MemberCoursesActionsEnum.REMOVE:
             for course in self.validated_data.get("courses", []):
                 if self._member.waiting_courses.filter(pk=course.pk):
@@ -708,15 +855,18 @@ class MemberCoursesSerializer(serializers.Serializer):
             )
             self._member.cancel_refund = self.validated_data.get("cancel_refund")
             self._member.save()
-            email_sender = EmailSender(EmailEnum.COURSE_CANCELLED)
-            for course in self.validated_data.get("courses", []):
-                email_sender.send_email(
-                    emails=[
+            EmailSender(EmailEnum.COURSE_CANCELLED).send_emails(
+                (
+                    [
                         self._member.email,
                         self._member.user.username,
                         settings.SUPERUSER_EMAIL,
                     ],
-                    full_name=f"{self._member.first_name} {self._member.last_name}",
-                    course_name=course.name,
-                    cancel_refund=refund_delta,
+                    {
+                        "full_name": f"{self._member.first_name} {self._member.last_name}",
+                        "course_name": course.name,
+                        "cancel_refund": refund_delta,
+                    },
                 )
+                for course in self.validated_data.get("courses", [])
+            )
@@ -16,8 +16,18 @@ You should have received a copy of the GNU Affero General Public License along
 with KDance registration. If not, see <https://www.gnu.org/licenses/>.
 """
 
+import base64
+import binascii
+import json
+
+from functools import cached_property
+from typing import Sequence
+
+from members.archives import archive_path, list_archives, read_records
 from members.emails import EmailEnum, EmailSender
 from members.models import (
+    Announcement,
+    AnnouncementRecipient,
     Check,
     Course,
     GeneralSettings,
@@ -25,8 +35,11 @@ from members.models import (
     Payment,
     Season,
     Teacher,
+    normalize_search,
 )
 from members.api.serializers import (
+    AnnouncementRecipientSerializer,
+    AnnouncementSerializer,
     CheckSerializer,
     CourseCopySeasonSerializer,
     CourseRetrieveSerializer,
@@ -34,18 +47,26 @@ from members.api.serializers import (
     GeneralSettingsSerializer,
     MemberCoursesActionsEnum,
     MemberCoursesSerializer,
+    MemberNormalizedSerializer,
+    MemberNormalizedShortSerializer,
     MemberRetrieveSerializer,
     MemberRetrieveShortSerializer,
     MemberSerializer,
     PaymentSerializer,
     SeasonSerializer,
     TeacherSerializer,
+    parse_fields,
+    prune_fields,
 )
 
 from django.conf import settings
-from django.db.models import Count, Q
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.generics import GenericAPIView
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.mixins import (
     CreateModelMixin,
     DestroyModelMixin,
@@ -53,10 +74,11 @@ from rest_framework.mixins import (
     RetrieveModelMixin,
     UpdateModelMixin,
 )
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import serializers
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.viewsets import GenericViewSet
 
 
@@ -75,6 +97,242 @@ class StandardPagination(PageNumberPagination):
         return int(page_number) // self.get_page_size(request) + 1
 
 
+class MemberCursorPagination(BasePagination):
+    """Keyset pagination on (season year, last name, first name, id).
+
+    Pages are fetched with a WHERE clause on the last seen position instead of an
+    OFFSET, and the total count is only computed when `with_count` is set. The
+    ordering is fixed, a `sort` parameter is rejected.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 100
+    max_page_size = 500
+    ordering = ("-season__year", "last_name", "first_name", "id")
+    invalid_cursor_message = "Curseur invalide."
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, position: list, reverse: bool) -> str:
+        data = json.dumps({"p": position, "r": int(reverse)}).encode()
+        cursor = base64.urlsafe_b64encode(data).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, request: Request) -> tuple[list | None, bool]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = data["p"], bool(data["r"])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def get_position(member: Member) -> list:
+        return [member.season.year, member.last_name, member.first_name, member.pk]
+
+    def filter_after(self, position: list, reverse: bool) -> Q:
+        """Rows strictly after position, in the (possibly reversed) ordering."""
+        condition = Q()
+        equal: dict = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") != reverse else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request: Request, view=None) -> list:
+        self.request = request
+        if request.query_params.get("sort"):
+            raise ValidationError(
+                {"sort": ["Le tri n'est pas disponible avec un curseur."]}
+            )
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        self.count = None
+        if request.query_params.get("with_count", "").lower() in ["true", "1"]:
+            self.count = queryset.count()
+
+        ordering: tuple[str, ...] = self.ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith("-") else f"-{field}"
+                for field in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.filter_after(position, reverse))
+        results = list(queryset[: page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next = self.previous = None
+        if results and has_next:
+            self.next = self.encode_cursor(self.get_position(results[-1]), False)
+        if results and has_previous:
+            self.previous = self.encode_cursor(self.get_position(results[0]), True)
+        return results
+
+    def get_paginated_response(self, data) -> Response:
+        response = {"next": self.next, "previous": self.previous, "results": data}
+        if self.count is not None:
+            response["count"] = self.count
+        return Response(response)
+
+
+class SparseFieldsMixin(GenericAPIView):
+    """Prune serialized fields of GET requests from `fields` and `exclude` params.
+
+    Both take comma separated, dotted paths: `fields=id,payment.due`.
+    """
+
+    @cached_property
+    def sparse_fields(self) -> tuple[dict | None, dict]:
+        if self.request.method != "GET":
+            return None, {}
+        fields = self.request.query_params.get("fields")
+        exclude = self.request.query_params.get("exclude", "")
+        return (parse_fields(fields) if fields else None), parse_fields(exclude)
+
+    def field_requested(self, path: str) -> bool:
+        """Whether the (dotted) field path is serialized."""
+        fields, exclude = self.sparse_fields
+        for name in path.split("."):
+            if fields:
+                if name not in fields:
+                    return False
+                fields = fields[name]
+            if name in exclude:
+                if not exclude[name]:
+                    return False
+                exclude = exclude[name]
+            else:
+                exclude = {}
+        return True
+
+    def get_serializer(self, *args, **kwargs) -> serializers.BaseSerializer:
+        serializer = super().get_serializer(*args, **kwargs)
+        prune_fields(serializer, *self.sparse_fields)
+        return serializer
+
+
+class NormalizedContentNegotiation(DefaultContentNegotiation):
+    """`format=normalized` selects the response layout, not a renderer."""
+
+    def filter_renderers(self, renderers, format):
+        if format == "normalized":
+            return renderers
+        return super().filter_renderers(renderers, format)
+
+
+class ArchiveViewSet(GenericViewSet):
+    """Read-only access to the archived seasons, streamed as JSON lines."""
+
+    http_method_names = ["get"]
+    lookup_field = "year"
+    lookup_value_regex = r"\d{4}-\d{4}"
+
+    def list(self, request: Request) -> Response:
+        return Response(list_archives())
+
+    def retrieve(self, request: Request, year: str) -> StreamingHttpResponse:
+        if not archive_path(year).exists():
+            raise NotFound("Archive introuvable.")
+        records = read_records(year, request.query_params.getlist("type"))
+        search = normalize_search(request.query_params.get("search", ""))
+        if search:
+            records = (
+                record
+                for record in records
+                if record["type"] in ("member", "contact")
+                and any(
+                    normalize_search(name).startswith(search)
+                    for name in (
+                        f"{record['data']['first_name']} {record['data']['last_name']}",
+                        f"{record['data']['last_name']} {record['data']['first_name']}",
+                    )
+                )
+            )
+        return StreamingHttpResponse(
+            (json.dumps(record) + "\n" for record in records),
+            content_type="application/x-ndjson",
+        )
+
+
+class AnnouncementViewSet(
+    CreateModelMixin,
+    ListModelMixin,
+    RetrieveModelMixin,
+    GenericViewSet,
+):
+    """Emails to the members of a season, a course or a teacher's courses."""
+
+    serializer_class = AnnouncementSerializer
+    http_method_names = ["get", "post"]
+
+    def get_queryset(self):
+        return Announcement.objects.annotate(
+            **{
+                recipient_status.value: Count(
+                    "recipients", filter=Q(recipients__status=recipient_status)
+                )
+                for recipient_status in AnnouncementRecipient.StatusEnum
+            }
+        ).order_by("-created", "-id")
+
+    def create(self, request: Request, *args, **kwargs) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        announcement = serializer.save()
+        announcement.add_recipients()
+        return Response(
+            self.get_serializer(self.get_queryset().get(pk=announcement.pk)).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(methods=["post"], detail=True)
+    def pause(self, request: Request, *_a, **_k) -> Response:
+        self.get_object().pause()
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(methods=["post"], detail=True)
+    def resume(self, request: Request, *_a, **_k) -> Response:
+        announcement = self.get_object()
+        if announcement.status == Announcement.StatusEnum.SENDING:
+            return Response(
+                {"status": ["L'annonce est déjà en cours d'envoi."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        announcement.resume()
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(methods=["get"], detail=True)
+    def recipients(self, request: Request, *_a, **_k) -> Response:
+        recipients = self.get_object().recipients.order_by("email")
+        recipient_status = request.query_params.get("status")
+        if recipient_status:
+            recipients = recipients.filter(status=recipient_status)
+        return Response(AnnouncementRecipientSerializer(recipients, many=True).data)
+
+
 class GeneralSettingsViewSet(
     RetrieveModelMixin,
     UpdateModelMixin,
@@ -109,6 +367,12 @@ class SeasonViewSet(
             queryset = queryset.filter(is_current=False)
         return queryset.order_by("-year")
 
+    @action(methods=["get"], detail=True)
+    def summary(self, request: Request, *_a, **_k) -> Response:
+        if not request.user.is_superuser:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        return Response(self.get_object().financial_summary())
+
 
 class TeacherViewSet(
     CreateModelMixin,
@@ -124,6 +388,7 @@ class TeacherViewSet(
 
 
 class PaymentViewSet(
+    SparseFieldsMixin,
     ListModelMixin,
     UpdateModelMixin,
     GenericViewSet,
@@ -132,7 +397,7 @@ class PaymentViewSet(
     http_method_names = ["get", "patch"]
 
     def get_queryset(self):
-        queryset = Payment.objects.all()
+        queryset = Payment.objects.with_details()
         season = self.request.query_params.get("season")
         if season:
             queryset = queryset.annotate(
@@ -162,6 +427,7 @@ class CheckViewSet(
 
 
 class CourseViewSet(
+    SparseFieldsMixin,
     CreateModelMixin,
     ListModelMixin,
     RetrieveModelMixin,
@@ -177,7 +443,10 @@ class CourseViewSet(
         return CourseSerializer
 
     def get_queryset(self):
-        queryset = Course.objects.all()
+        queryset = Course.objects.select_related("teacher", "season")
+        if self.request.method == "GET":
+            # Annotations would be stale after an update
+            queryset = queryset.with_counts()
         season = self.request.query_params.get("season")
         if season:
             queryset = queryset.filter(season__id=season)
@@ -187,15 +456,23 @@ class CourseViewSet(
     def copy_season(self, request: Request) -> Response:
         body = CourseCopySeasonSerializer(data=request.data)
         body.is_valid(raise_exception=True)
-        Course.objects.copy_from_season(**body.validated_data)
-        answer = CourseRetrieveSerializer(
-            Course.objects.filter(season_id=body.validated_data["to_season"]).all(),
-            many=True,
+        skipped = Course.objects.copy_from_season(**body.validated_data)
+        courses = Course.objects.select_related("teacher", "season")
+        return Response(
+            {
+                "courses": CourseRetrieveSerializer(
+                    courses.filter(season_id=body.validated_data["to_season"]),
+                    many=True,
+                ).data,
+                "skipped": CourseRetrieveSerializer(
+                    courses.filter(id__in=skipped), many=True
+                ).data,
+            }
         )
-        return Response(answer.data)
 
 
 class MemberViewSet(
+    SparseFieldsMixin,
     CreateModelMixin,
     ListModelMixin,
     RetrieveModelMixin,
@@ -204,10 +481,20 @@ class MemberViewSet(
     GenericViewSet,
 ):
     http_method_names = ["get", "post", "patch", "delete", "put"]
+    content_negotiation_class = NormalizedContentNegotiation
+
+    @property
+    def normalized(self) -> bool:
+        return (
+            self.action == "list"
+            and self.request.query_params.get("format") == "normalized"
+        )
 
     @property
     def pagination_class(self):
         if self.request.method.lower() == "get":
+            if MemberCursorPagination.cursor_query_param in self.request.query_params:
+                return MemberCursorPagination
             if self.request.query_params.get("without_details", "").lower() in [
                 "true",
                 "1",
@@ -221,7 +508,11 @@ class MemberViewSet(
                 "true",
                 "1",
             ]:
+                if self.normalized:
+                    return MemberNormalizedShortSerializer
                 return MemberRetrieveShortSerializer
+            if self.normalized:
+                return MemberNormalizedSerializer
             return MemberRetrieveSerializer
         return MemberSerializer
 
@@ -229,7 +520,23 @@ class MemberViewSet(
         queryset = (
             Member.objects.all()
             .select_related("documents", "season", "user")
-            .prefetch_related("active_courses", "cancelled_courses")
+            .prefetch_related(
+                *(
+                    Prefetch(
+                        name,
+                        Course.objects.with_counts().select_related(
+                            "teacher", "season"
+                        ),
+                    )
+                    for name in (
+                        "active_courses",
+                        "cancelled_courses",
+                        "waiting_courses",
+                    )
+                    if self.field_requested(name)
+                ),
+                *(["contacts"] if self.field_requested("contacts") else []),
+            )
         )
         season = self.request.query_params.get("season")
         course = self.request.query_params.get("course")
@@ -256,9 +563,7 @@ class MemberViewSet(
             else:
                 queryset = queryset.filter(ffd_license=0)
         if search:
-            queryset = queryset.filter(
-                Q(first_name__icontains=search) | Q(last_name__icontains=search)
-            )
+            queryset = queryset.filter(Member.search_filter(search))
         if sort:
             order_prefix = (
                 "-" if self.request.query_params.get("order", "asc") == "desc" else ""
@@ -266,20 +571,20 @@ class MemberViewSet(
             if sort == "name":
                 order_by = [f"{order_prefix}last_name", f"{order_prefix}first_name"]
             elif sort == "solde":
-                order_by = []
+                queryset = queryset.annotate(
+                    solde=Subquery(
+                        Payment.objects.with_balance()
+                        .filter(user=OuterRef("user"), season=OuterRef("season"))
+                        .values("balance")[:1]
+                    )
+                )
+                order_by = [f"{order_prefix}solde", "last_name", "first_name"]
             else:
                 order_by = [f"{order_prefix}{sort.replace('.', '__')}"]
         else:
             order_by = ["last_name", "first_name"]
 
-        queryset = queryset.distinct()
-        if order_by:
-            return queryset.order_by("-season__year", *order_by)
-        return sorted(
-            queryset,
-            key=lambda m: m.payment.due - m.payment.paid + m.payment.refund,
-            reverse=bool(order_prefix),
-        )
+        return queryset.distinct().order_by("-season__year", *order_by)
 
     def retrieve(self, request: Request, *a, **k) -> Response:
         instance = self.get_object()
@@ -297,14 +602,58 @@ class MemberViewSet(
             ).exists()
         ):
             queryset = queryset.filter(user__id=request.user.pk)
+        with_payment = self.field_requested("payment")
         page = self.paginate_queryset(queryset)
         if page is not None:
+            if with_payment:
+                Member.objects.attach_payments(page)
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
+            response = self.get_paginated_response(serializer.data)
+            if self.normalized:
+                response.data["included"] = self.get_included(page)
+            return response
+
+        members = list(queryset)
+        if with_payment:
+            Member.objects.attach_payments(members)
+        serializer = self.get_serializer(members, many=True)
+        if self.normalized:
+            return Response(
+                {"results": serializer.data, "included": self.get_included(members)}
+            )
         return Response(serializer.data)
 
+    def get_included(self, members: Sequence[Member]) -> dict:
+        """Serialize once the courses, seasons and teachers the members refer to."""
+        courses: dict[int, Course] = {}
+        seasons: dict[int, Season] = {}
+        for name in ("active_courses", "cancelled_courses", "waiting_courses"):
+            if self.field_requested(name):
+                for member in members:
+                    courses.update(
+                        (course.pk, course) for course in getattr(member, name).all()
+                    )
+        for course in courses.values():
+            seasons[course.season_id] = course.season
+        if self.field_requested("season"):
+            seasons.update((member.season_id, member.season) for member in members)
+        teachers = {
+            course.teacher_id: course.teacher
+            for course in courses.values()
+            if course.teacher_id is not None
+        }
+        return {
+            "courses": {
+                pk: CourseSerializer(course).data for pk, course in courses.items()
+            },
+            "seasons": {
+                pk: SeasonSerializer(season).data for pk, season in seasons.items()
+            },
+            "teachers": {
+                pk: TeacherSerializer(teacher).data for pk, teacher in teachers.items()
+            },
+        }
+
     def create(self, request: Request, *a, **k) -> Response:
         SIGNUP_ERROR = "Les inscriptions ne sont pas ouvertes. Vous ne pouvez pas ajouter d'adhérent pour le moment."
         if not GeneralSettings.get_solo().allow_new_member:
@@ -313,7 +662,7 @@ class MemberViewSet(
             )
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        current_season = Season.objects.filter(is_current=True).first()
+        current_season = Season.objects.current()
         if not current_season or str(request.data["season"]) != str(current_season.id):
             return Response(
                 status=status.HTTP_405_METHOD_NOT_ALLOWED, data={"error": SIGNUP_ERROR}
@@ -0,0 +1,178 @@
+"""
+Copyright 2024, 2025 Andréa Marnier
+
+This file is part of KDance registration.
+
+KDance registration is free software: you can redistribute it and/or modify it
+under the terms of the GNU Affero General Public License as published by the
+Free Software Foundation, either version 3 of the License, or any later version.
+
+KDance registration is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+for more details.
+
+You should have received a copy of the GNU Affero General Public License along
+with KDance registration. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import json
+import tempfile
+
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, QuerySet, Value
+from django.utils import timezone
+
+from members.models import (
+    Ancv,
+    CBPayment,
+    Check,
+    Contact,
+    Course,
+    Member,
+    OtherPayment,
+    Payment,
+    Season,
+    SportCoupon,
+    SportPass,
+)
+
+# Bumped whenever the layout of archived records changes
+# 2: payment methods and sport passes
+SCHEMA_VERSION = 2
+CHUNK_SIZE = 2000
+# Search columns are derived from the names, no need to keep them
+SKIPPED_FIELDS = ("search_name", "search_name_reverse")
+
+
+def archive_path(year: str) -> Path:
+    return Path(settings.SEASON_ARCHIVE_DIR) / f"season-{year}.jsonl.gz"
+
+
+def _records(season: Season) -> Iterator[tuple[str, QuerySet]]:
+    yield (
+        "course",
+        Course._base_manager.filter(season=season).annotate(
+            teacher_name=F("teacher__name")
+        ),
+    )
+    yield (
+        "member",
+        Member._base_manager.filter(season=season).annotate(
+            user_email=F("user__email")
+        ),
+    )
+    yield "sport_pass", SportPass.objects.filter(member__season=season)
+    for status, through in (
+        ("active", Member.active_courses.through),
+        ("waiting", Member.waiting_courses.through),
+        ("cancelled", Member.cancelled_courses.through),
+    ):
+        yield (
+            "member_course",
+            through.objects.filter(member__season=season).annotate(
+                status=Value(status)
+            ),
+        )
+    yield (
+        "contact",
+        Contact._base_manager.filter(member__season=season).distinct(),
+    )
+    yield (
+        "member_contact",
+        Member.contacts.through.objects.filter(member__season=season),
+    )
+    yield (
+        "payment",
+        Payment.objects.filter(season=season).annotate(user_email=F("user__email")),
+    )
+    yield "other_payment", OtherPayment.objects.filter(payment__season=season)
+    for record_type, model in (
+        ("check", Check),
+        ("cb_payment", CBPayment),
+        ("sport_coupon", SportCoupon),
+        ("ancv", Ancv),
+    ):
+        yield record_type, model.objects.filter(payment__season=season)
+
+
+def export_season(season: Season) -> Path:
+    """Write the season and its records to a gzipped JSON lines bundle.
+
+    The first line holds the schema version and the season itself, each
+    following line a {"type": ..., "data": {...}} record. An existing bundle
+    is kept as is, so an interrupted purge can export again safely."""
+    path = archive_path(season.year)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # One file per run, so concurrent exports don't write into each other
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".partial", delete=False
+    ) as file:
+        partial = Path(file.name)
+    try:
+        _write_bundle(partial, season)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    partial.replace(path)
+    return path
+
+
+def _write_bundle(partial: Path, season: Season) -> None:
+    with gzip.open(partial, "wt", encoding="utf-8") as stream:
+        header = {
+            "schema": SCHEMA_VERSION,
+            "created": timezone.now(),
+            "season": Season._base_manager.filter(pk=season.pk).values().get(),
+        }
+        stream.write(json.dumps(header, cls=DjangoJSONEncoder) + "\n")
+        for record_type, queryset in _records(season):
+            for row in queryset.values().iterator(chunk_size=CHUNK_SIZE):
+                for field in SKIPPED_FIELDS:
+                    row.pop(field, None)
+                stream.write(
+                    json.dumps(
+                        {"type": record_type, "data": row}, cls=DjangoJSONEncoder
+                    )
+                    + "\n"
+                )
+
+
+def read_header(year: str) -> dict:
+    with gzip.open(archive_path(year), "rt", encoding="utf-8") as stream:
+        return json.loads(stream.readline())
+
+
+def read_records(year: str, types: Iterable[str] = ()) -> Iterator[dict]:
+    """Stream the records of an archived season, optionally of some types only."""
+    types = set(types)
+    with gzip.open(archive_path(year), "rt", encoding="utf-8") as stream:
+        stream.readline()
+        for line in stream:
+            record = json.loads(line)
+            if not types or record["type"] in types:
+                yield record
+
+
+def list_archives() -> list[dict]:
+    """Headers of the archived seasons, most recent first."""
+    archives = []
+    for path in Path(settings.SEASON_ARCHIVE_DIR).glob("season-*.jsonl.gz"):
+        year = path.name.removeprefix("season-").removesuffix(".jsonl.gz")
+        header = read_header(year)
+        archives.append(
+            {
+                "year": year,
+                "schema": header["schema"],
+                "created": header["created"],
+                "size": path.stat().st_size,
+            }
+        )
+    return sorted(archives, key=lambda archive: archive["year"], reverse=True)
@@ -0,0 +1,80 @@
+"""
+Copyright 2024, 2025 Andréa Marnier
+
+This file is part of KDance registration.
+
+KDance registration is free software: you can redistribute it and/or modify it
+under the terms of the GNU Affero General Public License as published by the
+Free Software Foundation, either version 3 of the License, or any later version.
+
+KDance registration is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+for more details.
+
+You should have received a copy of the GNU Affero General Public License along
+with KDance registration. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse
+
+GENERAL_SETTINGS_KEY = "general-settings"
+CURRENT_SEASON_KEY = "current-season"
+
+_request = threading.local()
+_missing = object()
+
+
+@contextmanager
+def request_scope() -> Iterator[None]:
+    """Within the block, cached values are read at most once."""
+    _request.values = {}
+    try:
+        yield
+    finally:
+        _request.values = None
+
+
+def get_or_load(key: str, loader: Callable[[], Any]) -> Any:
+    """Value from the request scope, then the shared cache, then the loader."""
+    values = getattr(_request, "values", None)
+    if values is not None and key in values:
+        return values[key]
+    value = cache.get(key, _missing)
+    if value is _missing:
+        value = loader()
+        cache.set(key, value, settings.CURRENT_CACHE_TIMEOUT)
+    if values is not None:
+        values[key] = value
+    return value
+
+
+def invalidate(*keys: str) -> None:
+    """Forget values now, and again once the transaction is committed."""
+
+    def forget() -> None:
+        cache.delete_many(keys)
+        values = getattr(_request, "values", None)
+        if values is not None:
+            for key in keys:
+                values.pop(key, None)
+
+    forget()
+    transaction.on_commit(forget)
+
+
+class RequestCacheMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with request_scope():
+            return self.get_response(request)
@@ -0,0 +1,82 @@
+import time
+from datetime import date
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from members.emails import EmailEnum, EmailSender
+
+COURSES = [SimpleNamespace(name=name) for name in ("Eveil", "Jazz", "Hip hop")]
+
+# Representative contexts. The waiting list alert reads the database and is
+# left out, as it is only sent to the team.
+SAMPLES: dict[EmailEnum, dict] = {
+    EmailEnum.CREATE_USER: {"username": "michel@plop.com"},
+    EmailEnum.DELETE_USER: {"username": "michel@plop.com"},
+    EmailEnum.UPDATE_USER_EMAIL: {
+        "username": "michel@plop.com",
+        "members": ["Michel", "Michelle"],
+    },
+    EmailEnum.CREATE_MEMBER: {
+        "full_name": "Michel",
+        "season_year": "2000-2001",
+        "active_courses": COURSES[:2],
+        "waiting_courses": COURSES[2:],
+    },
+    EmailEnum.DELETE_MEMBER: {"full_name": "Michel", "season_year": "2000-2001"},
+    EmailEnum.COURSE_CANCELLED: {
+        "full_name": "Michel",
+        "course_name": "Eveil",
+        "cancel_refund": 50,
+    },
+    EmailEnum.COURSES_UPDATE: {
+        "full_name": "Michel",
+        "courses_added_active": COURSES[:1],
+        "courses_added_waiting": COURSES[1:2],
+        "courses_removed": COURSES[2:],
+    },
+    EmailEnum.PAYMENT_UNKNOWN: {"username": "michel@plop.com"},
+    EmailEnum.PRE_SIGNUP_WARNING: {
+        "username": "michel@plop.com",
+        "full_name": "Michel",
+        "birthday": date(2000, 1, 1),
+    },
+    EmailEnum.WAITING_TO_ACTIVE_COURSE: {
+        "full_name": "Michel",
+        "course_name": "Eveil",
+        "weekday": "Lundi",
+        "start_hour": "12h12",
+        "with_next_course_warning": True,
+    },
+    EmailEnum.RESET_PWD: {"url": "https://adherents.association-kdance.fr/"},
+    EmailEnum.ANNOUNCEMENT: {
+        "subject": "Gala de fin d'année",
+        "message": "Le gala aura lieu le 21 juin.\nVenez nombreux!",
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Measure the cost of building each type of email, per message."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--number",
+            type=int,
+            default=1000,
+            help="Emails built per type.",
+        )
+
+    def handle(self, *args, **options) -> None:
+        number = options["number"]
+        for email_type, kwargs in SAMPLES.items():
+            sender = EmailSender(email_type)
+            # The first build compiles the templates, which are then cached.
+            sender.build_email(["michel@plop.com"], **kwargs)
+            start = time.perf_counter()
+            for _ in range(number):
+                sender.build_email(["michel@plop.com"], **kwargs)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{email_type.value}: {elapsed / number * 1e6:.1f} µs/email"
+            )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from members.models import Payment, PaymentBalance, Season
+
+
+class Command(BaseCommand):
+    help = "Rebuild or verify the stored payment balances of a season."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "season",
+            nargs="?",
+            help="Season year, such as 2024-2025. Current season by default.",
+        )
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report drifted balances, without repairing them.",
+        )
+
+    def handle(self, *args, **options) -> None:
+        try:
+            if options["season"]:
+                season = Season.objects.get(year=options["season"])
+            else:
+                season = Season.objects.get(is_current=True)
+        except Season.DoesNotExist:
+            raise CommandError("Saison introuvable.")
+        payments = Payment.objects.filter(season=season)
+        if not options["verify"]:
+            balances = PaymentBalance.objects.refresh(payments)
+            self.stdout.write(
+                f"{len(balances)} solde(s) recalculé(s) pour la saison {season.year}."
+            )
+            return
+        drifted = PaymentBalance.objects.drifted(payments)
+        for balance in drifted:
+            self.stdout.write(
+                f"Solde incohérent: paiement {balance.payment.pk} "
+                f"({balance.payment.user.username})"
+            )
+        if drifted:
+            raise CommandError(
+                f"{len(drifted)} solde(s) incohérent(s) pour la saison {season.year}."
+            )
+        self.stdout.write(f"Soldes cohérents pour la saison {season.year}.")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandParser
+
+from members.models import Season
+
+
+class Command(BaseCommand):
+    help = "Delete the expired seasons, by batches. Can be run again if interrupted."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=Season.objects.PURGE_BATCH_SIZE,
+            help="Number of rows deleted per transaction.",
+        )
+
+    def handle(self, *args, **options) -> None:
+        total = Season.objects.purge(
+            batch_size=options["batch_size"], progress=self.stdout.write
+        )
+        self.stdout.write(f"{total} ligne(s) supprimée(s).")
@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from members.models import Announcement
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the announcements in progress, all of them within one "
+        "messages-per-minute budget. Run a single worker."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the announcements in progress and stop, instead of polling.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait when no announcement is in progress.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.ANNOUNCEMENT_BATCH_SIZE,
+            help="Emails sent over one SMTP connection.",
+        )
+        parser.add_argument(
+            "--per-minute",
+            type=int,
+            default=settings.ANNOUNCEMENT_PER_MINUTE,
+            help="Maximum number of emails sent per minute.",
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options["batch_size"] < 1 or options["per_minute"] < 1:
+            raise CommandError("Les limites d'envoi doivent être positives.")
+        email_interval = 60 / options["per_minute"]
+        while True:
+            announcement = (
+                Announcement.objects.filter(status=Announcement.StatusEnum.SENDING)
+                .order_by("created", "id")
+                .first()
+            )
+            if announcement is None:
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+                continue
+            sent, failed = announcement.send_batch(options["batch_size"])
+            self.stdout.write(
+                f"{announcement.subject}: {sent} email(s) envoyé(s), "
+                f"{failed} échec(s), {announcement.get_status_display()}."
+            )
+            # The budget is shared by all the announcements
+            time.sleep((sent + failed) * email_interval)
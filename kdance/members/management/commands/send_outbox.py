@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from members.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = "Send the emails waiting in the outbox, retrying failed ones later."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the due emails and stop, instead of polling the outbox.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait when the outbox is empty.",
+        )
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Attempts before an email is marked as failed.",
+        )
+
+    def handle(self, *args, **options) -> None:
+        while True:
+            sent, failed = EmailOutbox.objects.send_pending(
+                options["batch_size"], options["max_attempts"]
+            )
+            if sent or failed:
+                self.stdout.write(f"{sent} email(s) envoyé(s), {failed} échec(s).")
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
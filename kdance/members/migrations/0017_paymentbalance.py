@@ -0,0 +1,49 @@
+# Generated by Django 5.0 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("members", "0016_waitinglist"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("due", models.IntegerField(default=0)),
+                ("paid", models.FloatField(default=0.0)),
+                ("refund", models.FloatField(default=0.0)),
+                ("balance", models.FloatField(default=0.0)),
+                ("due_detail", models.JSONField(default=list)),
+                ("members_count", models.PositiveIntegerField(default=0)),
+                ("courses_count", models.PositiveIntegerField(default=0)),
+                ("courses_price", models.PositiveIntegerField(default=0)),
+                ("licenses_count", models.PositiveIntegerField(default=0)),
+                ("licenses_price", models.PositiveIntegerField(default=0)),
+                ("cancel_refunds", models.FloatField(default=0.0)),
+                ("sport_pass_count", models.PositiveIntegerField(default=0)),
+                ("sport_pass_amount", models.PositiveIntegerField(default=0)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "payment",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payment_balance",
+                        to="members.payment",
+                    ),
+                ),
+            ],
+        ),
+    ]
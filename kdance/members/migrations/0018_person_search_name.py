@@ -0,0 +1,67 @@
+# Generated by Django 5.0 on 2026-10-18 09:45
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss"})
+
+
+def _normalize(value):
+    decomposed = unicodedata.normalize("NFKD", value.casefold().translate(LIGATURES))
+    return " ".join(
+        "".join(char for char in decomposed if not unicodedata.combining(char)).split()
+    )
+
+
+def _fill_search_names(apps, *_):
+    for model_name in ("Contact", "Member"):
+        Model = apps.get_model("members", model_name)
+        people = list(Model.objects.all())
+        for person in people:
+            first_name = _normalize(person.first_name)
+            last_name = _normalize(person.last_name)
+            person.search_name = f"{first_name} {last_name}"
+            person.search_name_reverse = f"{last_name} {first_name}"
+        Model.objects.bulk_update(
+            people, ["search_name", "search_name_reverse"], batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("members", "0017_paymentbalance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contact",
+            name="search_name",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=61
+            ),
+        ),
+        migrations.AddField(
+            model_name="contact",
+            name="search_name_reverse",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=61
+            ),
+        ),
+        migrations.AddField(
+            model_name="member",
+            name="search_name",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=61
+            ),
+        ),
+        migrations.AddField(
+            model_name="member",
+            name="search_name_reverse",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=61
+            ),
+        ),
+        migrations.RunPython(_fill_search_names, migrations.RunPython.noop),
+    ]
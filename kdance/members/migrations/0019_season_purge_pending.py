@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("members", "0018_person_search_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="season",
+            name="purge_pending",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
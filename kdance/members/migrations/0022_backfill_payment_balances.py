@@ -0,0 +1,12 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Balances are computed by the annotations of the current models, that
+    # historical models lack: existing payments are filled by the
+    # payment_balances command after the upgrade, see the README.
+    dependencies = [
+        ("members", "0021_announcement"),
+    ]
+
+    operations: list = []
@@ -0,0 +1,39 @@
+# Generated by Django 5.0 on 2026-10-18 11:01
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_taken_seats(apps, *_):
+    Course = apps.get_model("members", "Course")
+    Through = apps.get_model("members", "Member").active_courses.through
+    Course.objects.update(
+        taken=Coalesce(
+            Subquery(
+                # Members of deleted users are not counted
+                Through.objects.filter(
+                    course=OuterRef("pk"), member__user__isnull=False
+                )
+                .values("course")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("members", "0022_backfill_payment_balances"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="taken",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(_count_taken_seats, migrations.RunPython.noop),
+    ]
@@ -17,28 +17,60 @@ with KDance registration. If not, see <https://www.gnu.org/licenses/>.
 """
 
 import logging
+import threading
+import unicodedata
 
+from contextlib import contextmanager
+from functools import partial
 from enum import Enum
+from typing import Callable, Iterable, Iterator, Sequence
 from datetime import date, timedelta
 
+from members.caching import (
+    CURRENT_SEASON_KEY,
+    GENERAL_SETTINGS_KEY,
+    get_or_load,
+    invalidate,
+)
 from members.emails import EmailEnum, EmailSender
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.validators import (
     EmailValidator,
     MaxValueValidator,
     MinValueValidator,
     RegexValidator,
 )
-from django.db import models, transaction
-from django.db.models import Count, Q
-from django.db.models.signals import post_delete
-from django.db.utils import IntegrityError
-from django.dispatch import receiver
+from django.db import connections, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    FloatField,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
 from solo.models import SingletonModel
 
 _logger = logging.getLogger(__name__)
 
+# Sent when Payment.save validates members in bulk, instead of a post_save per
+# member. Arguments: payment, member_ids.
+members_validated = Signal()
+
 
 class GeneralSettings(SingletonModel):
     allow_signup = models.BooleanField(
@@ -54,9 +86,137 @@ class GeneralSettings(SingletonModel):
     )
     signup_payment_delta_days = models.PositiveBigIntegerField(null=False, default=7)
 
+    @classmethod
+    def get_solo(cls) -> "GeneralSettings":
+        return get_or_load(GENERAL_SETTINGS_KEY, super().get_solo)
+
+
+class SeasonManager(models.Manager["Season"]):
+    PURGE_BATCH_SIZE = 1000
+
+    def get_queryset(self) -> models.QuerySet["Season"]:
+        return super().get_queryset().filter(purge_pending=False)
+
+    def current(self) -> "Season | None":
+        """The current season, cached until a season is saved or deleted."""
+        return get_or_load(
+            CURRENT_SEASON_KEY, lambda: self.filter(is_current=True).first()
+        )
+
+    def purge(
+        self,
+        batch_size: int = PURGE_BATCH_SIZE,
+        progress: Callable[[str], None] | None = None,
+    ) -> int:
+        """Archive, then delete the seasons marked for purge and their rows.
+
+        Rows are removed by batches of raw deletes, children first, without
+        loading instances nor sending signals. Each batch is committed on its
+        own, so an interrupted purge resumes where it stopped."""
+        from members.archives import export_season
+
+        total = 0
+        seasons = Season._base_manager.filter(purge_pending=True).order_by("year")
+        for season in seasons:
+            path = export_season(season)
+            message = f"Saison {season.year}: archivée dans {path}"
+            _logger.info(message)
+            if progress:
+                progress(message)
+            for label, queryset, related in self._purge_steps(season):
+                deleted = self._delete_in_batches(queryset, batch_size, related)
+                total += deleted
+                message = f"Saison {season.year}: {deleted} {label} supprimé(s)"
+                _logger.info(message)
+                if progress:
+                    progress(message)
+            Season._base_manager.filter(pk=season.pk).delete()
+        return total
+
+    @staticmethod
+    def _purge_steps(season: "Season") -> Iterator[tuple]:
+        in_season = Q(member__season=season) | Q(course__season=season)
+        yield (
+            "inscription(s)",
+            Member.active_courses.through.objects.filter(in_season),
+            {},
+        )
+        yield "attente(s)", Member.waiting_courses.through.objects.filter(in_season), {}
+        yield (
+            "annulation(s)",
+            Member.cancelled_courses.through.objects.filter(in_season),
+            {},
+        )
+        yield (
+            "lien(s) de contact",
+            Member.contacts.through.objects.filter(member__season=season),
+            {},
+        )
+        yield "liste(s) d'attente", WaitingList.objects.filter(in_season), {}
+        yield (
+            "adhérent(s)",
+            Member._base_manager.filter(season=season),
+            {"documents": Documents, "sport_pass": SportPass},
+        )
+        for label, model in (
+            ("solde(s)", PaymentBalance),
+            ("chèque(s)", Check),
+            ("paiement(s) CB", CBPayment),
+            ("coupon(s) sport", SportCoupon),
+            ("ANCV", Ancv),
+        ):
+            yield label, model._base_manager.filter(payment__season=season), {}
+        yield (
+            "paiement(s)",
+            Payment.objects.filter(season=season),
+            {"other_payment": OtherPayment},
+        )
+        announced = Q(season=season) | Q(course__season=season)
+        yield (
+            "destinataire(s) d'annonce",
+            AnnouncementRecipient.objects.filter(
+                announcement__in=Announcement.objects.filter(announced)
+            ),
+            {},
+        )
+        yield "annonce(s)", Announcement.objects.filter(announced), {}
+        yield "cours", Course._base_manager.filter(season=season), {}
+
+    @staticmethod
+    def _delete_in_batches(
+        queryset: models.QuerySet, batch_size: int, related: dict
+    ) -> int:
+        """Raw delete the queryset rows, then the rows they pointed to in related."""
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                rows = list(queryset.values_list("pk", *related)[:batch_size])
+                if not rows:
+                    return deleted
+                batch = queryset.model._base_manager.filter(
+                    pk__in=[row[0] for row in rows]
+                )
+                deleted += batch._raw_delete(batch.db)
+                for i, model in enumerate(related.values(), 1):
+                    pointed = model._base_manager.filter(
+                        pk__in=[row[i] for row in rows if row[i] is not None]
+                    )
+                    pointed._raw_delete(pointed.db)
+
 
 class Season(models.Model):
     SEASON_COUNT = 5
+    PAYMENT_BATCH_SIZE = 500
+    # Amounts the payment balances depend on
+    BALANCE_FIELDS = (
+        "discount_percent",
+        "discount_limit",
+        "pass_sport_amount",
+        "ffd_a_amount",
+        "ffd_b_amount",
+        "ffd_c_amount",
+        "ffd_d_amount",
+    )
 
     year = models.CharField(
         null=False,
@@ -95,33 +255,137 @@ class Season(models.Model):
     ffd_d_amount = models.PositiveIntegerField(
         blank=False, verbose_name="Licence D Compétiteur international price"
     )
+    # Expired seasons are hidden, then deleted by SeasonManager.purge
+    purge_pending = models.BooleanField(default=False, editable=False)
+
+    objects = SeasonManager()
 
     @transaction.atomic
     def save(self, *args, **kwargs) -> None:
         created = self.pk is None
-        # When creating a new season, we delete the older ones
+        # When creating a new season, the older ones are hidden, then purged by
+        # the purge_seasons command
         if created and Season.objects.count() >= self.SEASON_COUNT:
             too_old = Season.objects.order_by("-year")[self.SEASON_COUNT - 1 :]
-            for season in too_old:
-                season.delete()
-        # When editing, we need to check if FFD amounts were updated
+            Season.objects.filter(
+                pk__in=list(too_old.values_list("pk", flat=True))
+            ).update(purge_pending=True, is_current=False)
+        # When editing, we need to check if amounts were updated
         prev_state = None
-        if not created and self.is_current:
-            prev_state = Season.objects.get(pk=self.pk)
+        if not created:
+            prev_state = Season._base_manager.filter(pk=self.pk).first()
         super().save(*args, **kwargs)
         # Only one current season is possible
         if self.is_current:
             Season.objects.exclude(year=self.year).update(is_current=False)
-        # At creation, we add Payment object for each User
+        # At creation, we add Payment object for each User, in batches.
+        # Their balance is computed the first time it is read.
         if created:
-            for user in User.objects.exclude(username=settings.SUPERUSER_EMAIL).all():
-                Payment(user=user, season=self).save()
+            user_ids = User.objects.exclude(
+                username=settings.SUPERUSER_EMAIL
+            ).values_list("pk", flat=True)
+            Payment.objects.bulk_create(
+                (Payment(user_id=user_id, season=self) for user_id in user_ids),
+                batch_size=self.PAYMENT_BATCH_SIZE,
+            )
         # If FFD amounts were updated, members need to be updated
         for attr in ("ffd_a_amount", "ffd_b_amount", "ffd_c_amount", "ffd_d_amount"):
-            if prev_state and getattr(prev_state, attr) != getattr(self, attr):
+            if (
+                prev_state
+                and self.is_current
+                and getattr(prev_state, attr) != getattr(self, attr)
+            ):
                 Member.objects.filter(ffd_license=getattr(prev_state, attr)).update(
                     ffd_license=getattr(self, attr)
                 )
+        # Balances only depend on the discount, sport pass and licenses amounts
+        if prev_state and any(
+            getattr(prev_state, attr) != getattr(self, attr)
+            for attr in self.BALANCE_FIELDS
+        ):
+            PaymentBalance.objects.refresh(Payment.objects.filter(season=self))
+
+    def financial_summary(self) -> dict:
+        """Totals of the season, aggregated in SQL and cached until balances change."""
+        payments = Payment.objects.filter(season=self)
+        # Payments never read yet have no balance
+        PaymentBalance.objects.refresh(payments.filter(payment_balance__isnull=True))
+        balances = PaymentBalance.objects.filter(payment__season=self)
+        version = balances.aggregate(count=Count("pk"), updated=Max("updated"))
+        cache_key = (
+            f"season-summary-{self.pk}-{version['count']}-"
+            f"{version['updated'].timestamp() if version['updated'] else 0}"
+        )
+        summary = cache.get(cache_key)
+        if summary is not None:
+            return summary
+        totals = balances.aggregate(
+            total_due=Coalesce(Sum("due"), 0),
+            total_cancel_refunds=Coalesce(Sum("cancel_refunds"), 0.0),
+            total_balance=Coalesce(Sum("balance"), 0.0),
+            outstanding=Coalesce(Sum("balance", filter=Q(balance__gt=0)), 0.0),
+        )
+        payment_totals = payments.aggregate(
+            cash=Coalesce(Sum("cash"), 0.0),
+            refund=Coalesce(Sum("refund"), 0.0),
+            special_discount=Coalesce(Sum("special_discount"), 0.0),
+        )
+
+        def method_totals(queryset: models.QuerySet) -> dict:
+            return queryset.aggregate(
+                amount=Coalesce(Sum("amount"), 0, output_field=FloatField()),
+                count=Count("pk"),
+            )
+
+        checks = Check.objects.filter(payment__season=self)
+        sport_pass_count = Member.objects.filter(
+            season=self, sport_pass__isnull=False
+        ).count()
+        methods = {
+            "checks": {
+                **method_totals(checks),
+                "by_month": list(
+                    checks.values("month")
+                    .annotate(amount=Sum("amount"), count=Count("pk"))
+                    .order_by("month")
+                ),
+            },
+            "cb": {
+                **method_totals(CBPayment.objects.filter(payment__season=self)),
+                "by_type": list(
+                    CBPayment.objects.filter(payment__season=self)
+                    .values("transaction_type")
+                    .annotate(amount=Sum("amount"), count=Count("pk"))
+                    .order_by("transaction_type")
+                ),
+            },
+            "ancv": method_totals(Ancv.objects.filter(payment__season=self)),
+            "sport_coupon": method_totals(
+                SportCoupon.objects.filter(payment__season=self)
+            ),
+            "sport_pass": {
+                "amount": sport_pass_count * self.pass_sport_amount,
+                "count": sport_pass_count,
+            },
+            "other": method_totals(OtherPayment.objects.filter(payment__season=self)),
+        }
+        summary = {
+            "season": self.year,
+            "due": totals["total_due"],
+            "paid": {
+                "total": payment_totals["cash"]
+                + sum(method["amount"] for method in methods.values()),
+                "cash": payment_totals["cash"],
+                **methods,
+            },
+            "refund": payment_totals["refund"],
+            "cancel_refunds": totals["total_cancel_refunds"],
+            "special_discount": payment_totals["special_discount"],
+            "balance": totals["total_balance"],
+            "outstanding": totals["outstanding"],
+        }
+        cache.set(cache_key, summary, timeout=60 * 60 * 24)
+        return summary
 
     @property
     def previous_season(self) -> str:
@@ -192,26 +456,149 @@ class Teacher(models.Model):
         super().save(*args, **kwargs)
 
 
+class CourseQuerySet(models.QuerySet):
+    def with_counts(self) -> models.QuerySet:
+        """Annotate members_count and waiting_count, used by is_complete and waiting."""
+        integer: IntegerField = IntegerField()
+        return self.annotate(
+            members_count=_aggregate_subquery(
+                Member.objects.filter(active_courses=OuterRef("pk")),
+                Count("pk"),
+                integer,
+            ),
+            waiting_count=_aggregate_subquery(
+                Member.objects.filter(waiting_courses=OuterRef("pk")),
+                Count("pk"),
+                integer,
+            ),
+        )
+
+
 class CourseManager(models.Manager):
-    def copy_from_season(self, from_season: int, to_season: int) -> None:
-        for course in self.filter(season__id=from_season).values().all():
-            try:
-                course.pop("id")
-                new_course = {
-                    **course,
-                    "season_id": to_season,
-                }
-                Course(**new_course).save()
-            except IntegrityError:
-                _logger.info("Cours non copié")
+    def copy_from_season(
+        self,
+        from_season: int,
+        to_season: int,
+        price_increase: int = 0,
+        capacity: int | None = None,
+    ) -> list[int]:
+        """Copy the courses of a season into another one in a single insert.
+
+        Prices are raised by ``price_increase`` percent (rounded up) and the
+        capacity of every copy is replaced by ``capacity`` when given.
+        Returns the ids of the source courses that were skipped because the
+        target season already holds the same course."""
+        existing = set(
+            self.filter(season__id=to_season).values_list(
+                "name", "weekday", "start_hour"
+            )
+        )
+        skipped = []
+        new_courses = []
+        for course in self.filter(season__id=from_season).order_by("id").values():
+            course_id = course.pop("id")
+            if (course["name"], course["weekday"], course["start_hour"]) in existing:
+                skipped.append(course_id)
+                continue
+            course["season_id"] = to_season
+            course["taken"] = 0
+            course["price"] = -(-course["price"] * (100 + price_increase) // 100)
+            if capacity is not None:
+                course["capacity"] = capacity
+            new_courses.append(Course(**course))
+        # Rows inserted concurrently in the meantime are silently skipped by
+        # the unique constraint instead of failing the whole copy.
+        Course.objects.bulk_create(new_courses, ignore_conflicts=True)
+        if skipped:
+            _logger.info("%s cours non copié(s)", len(skipped))
+        return skipped
 
     def manage_waiting_lists(self):
         if not GeneralSettings.get_solo().allow_new_member:
             return
-        current_season = Season.objects.get(is_current=True)
+        current_season = Season.objects.current()
         for course in self.filter(season__id=current_season.id):
             course.update_queue()
 
+    def reserve_seats(
+        self, member: "Member", courses: Iterable["Course"]
+    ) -> tuple[list["Course"], list["Course"]]:
+        """Seat member in the courses with room left, put it on the waiting list of
+        the others. Return both lists of courses.
+
+        Each seat is taken by a conditional UPDATE of the course counter,
+        atomic on every database: concurrent signups cannot all take the last
+        seat. Courses are updated in id order to avoid deadlocks between
+        requests asking for the same courses.
+        """
+        course_ids = sorted({course.pk for course in courses})
+        if not course_ids:
+            return [], []
+        with transaction.atomic():
+            # Writing first, SQLite makes concurrent writers wait for the lock
+            reserved = {
+                course_id
+                for course_id in course_ids
+                if Course.objects.filter(pk=course_id, taken__lt=F("capacity"))
+                .exclude(members=member)
+                .update(taken=F("taken") + 1)
+            }
+            held = set(
+                member.active_courses.filter(pk__in=course_ids).values_list(
+                    "pk", flat=True
+                )
+            )
+            by_id = Course.objects.in_bulk(course_ids)
+            active = [by_id[pk] for pk in course_ids if pk in reserved or pk in held]
+            waiting = [by_id[pk] for pk in course_ids if by_id[pk] not in active]
+            member.active_courses.add(*reserved)
+            if waiting:
+                member.waiting_courses.add(*waiting)
+                WaitingList.objects.bulk_create(
+                    [WaitingList(course=course, member=member) for course in waiting],
+                    ignore_conflicts=True,
+                )
+        return active, waiting
+
+    def recount_seats(self, course_ids: Iterable[int]) -> None:
+        """Set the seats taken of the courses to their number of active members.
+
+        Members of deleted users are left out, as in with_counts."""
+        Course.objects.filter(pk__in=list(course_ids)).update(
+            taken=_aggregate_subquery(
+                Member.active_courses.through.objects.filter(
+                    course=OuterRef("pk"), member__user__isnull=False
+                ),
+                Count("pk"),
+                IntegerField(),
+            )
+        )
+
+    _pending = threading.local()
+
+    def schedule_queue_update(self, course_ids: Iterable[int]) -> None:
+        """Update the waiting lists of these courses once, after commit."""
+        if not transaction.get_connection().in_atomic_block:
+            # Autocommit: already committed
+            self.process_queue_updates(set(course_ids))
+            return
+        update = getattr(self._pending, "update", None)
+        # A rolled back transaction drops its callback, and the courses with it
+        registered = transaction.get_connection().run_on_commit
+        if update is None or not any(func is update for _, func, _ in registered):
+            update = self._pending.update = partial(self.process_queue_updates, set())
+            transaction.on_commit(update)
+        update.args[0].update(course_ids)
+
+    def process_queue_updates(self, course_ids: set[int]) -> None:
+        update = getattr(self._pending, "update", None)
+        if update is not None and update.args[0] is course_ids:
+            self._pending.update = None
+        if not course_ids or not GeneralSettings.get_solo().allow_new_member:
+            return
+        for course in Course.objects.filter(pk__in=course_ids).select_related("season"):
+            course.update_queue()
+
 
 class Course(models.Model):
     name = models.CharField(
@@ -236,8 +623,11 @@ class Course(models.Model):
     start_hour = models.TimeField()
     end_hour = models.TimeField()
     capacity = models.PositiveIntegerField(null=False, default=12)
+    # Number of active members, the counter CourseManager.reserve_seats takes
+    # seats from. Never written by save: the instance value may be stale.
+    taken = models.PositiveIntegerField(default=0, editable=False)
 
-    objects = CourseManager()
+    objects = CourseManager.from_queryset(CourseQuerySet)()
 
     def __repr__(self) -> str:
         return f"{self.name} {self.season.year}"
@@ -250,51 +640,103 @@ class Course(models.Model):
 
     @property
     def is_complete(self) -> bool:
-        return self.members.count() >= self.capacity
+        members_count = getattr(self, "members_count", None)
+        if members_count is None:
+            members_count = self.members.count()
+        return members_count >= self.capacity
 
     @property
     def waiting(self) -> int:
-        return self.members_waiting.count()
+        waiting_count = getattr(self, "waiting_count", None)
+        if waiting_count is None:
+            waiting_count = self.members_waiting.count()
+        return waiting_count
 
     @transaction.atomic
     def save(self, *args, **kwargs) -> None:
         is_edit = self.pk is not None
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.fields
+                if not field.primary_key and field.name != "taken"
+            ]
         super().save(*args, **kwargs)
-        if is_edit and GeneralSettings.get_solo().allow_new_member:
-            self.update_queue()
+        if is_edit:  # Capacity may have changed
+            Course.objects.schedule_queue_update([self.pk])
 
     def update_queue(self) -> None:
-        while self.members_waiting.count() and not self.is_complete:
-            waiting_list = (
-                WaitingList.objects.filter(course=self).order_by("signup_date").first()
+        """Promote at once the oldest waiting members to the free seats."""
+        with transaction.atomic():
+            # Locked against concurrent reservations, with a fresh counter
+            taken = (
+                Course.objects.select_for_update()
+                .values_list("taken", flat=True)
+                .get(pk=self.pk)
             )
-            if not waiting_list:
-                EmailSender(EmailEnum.WAITING_LIST_INCONSISTENCY).send_email(
-                    emails=[settings.DEFAULT_FROM_EMAIL],
-                    course=self,
-                    member="aucun",
-                )
+            free_seats = self.capacity - taken
+            if free_seats <= 0:
+                return
+            to_promote = min(free_seats, self.members_waiting.count())
+            if not to_promote:
+                return
+            waiting_lists = list(
+                WaitingList.objects.select_for_update()
+                .filter(course=self)
+                .order_by("signup_date")[:to_promote]
+            )
+            if len(waiting_lists) < to_promote:
                 _logger.error("Problème avec la liste d'attente - update_queue")
-                break
-            member = waiting_list.member
-            with transaction.atomic():
-                member.active_courses.add(self)
-                member.waiting_courses.remove(self)
-                member.save()
-                waiting_list.delete()
-            email_sender = EmailSender(EmailEnum.WAITING_TO_ACTIVE_COURSE)
-            recipients = [member.email]
-            if member.user:
-                recipients.append(member.user.username)
-            email_sender.send_email(
-                emails=recipients,
-                full_name=f"{member.first_name} {member.last_name}",
-                course_name=self.name,
-                weekday=self.get_weekday_display(),
-                start_hour=self.start_hour.strftime("%Hh%M"),
-                with_next_course_warning=self.season.signup_end
-                and self.season.signup_end < date.today(),
+                transaction.on_commit(
+                    lambda: EmailSender(
+                        EmailEnum.WAITING_LIST_INCONSISTENCY
+                    ).send_email(
+                        emails=[settings.DEFAULT_FROM_EMAIL],
+                        course=self,
+                        member="aucun",
+                    )
+                )
+            if not waiting_lists:
+                return
+            member_ids = [waiting_list.member_id for waiting_list in waiting_lists]
+            ActiveCourse = Member.active_courses.through
+            ActiveCourse.objects.bulk_create(
+                [
+                    ActiveCourse(member_id=member_id, course_id=self.pk)
+                    for member_id in member_ids
+                ],
+                ignore_conflicts=True,
+            )
+            Member.waiting_courses.through.objects.filter(
+                course_id=self.pk, member_id__in=member_ids
+            ).delete()
+            WaitingList.objects.filter(
+                pk__in=[waiting_list.pk for waiting_list in waiting_lists]
+            ).delete()
+            # Bulk operations send no m2m_changed signal
+            Course.objects.recount_seats([self.pk])
+            PaymentBalance.objects.schedule(_member_payments(pk__in=member_ids))
+            transaction.on_commit(lambda: self.notify_promoted(member_ids))
+
+    def notify_promoted(self, member_ids: list[int]) -> None:
+        """Tell members moved from the waiting list that they got a seat."""
+        with_next_course_warning = (
+            self.season.signup_end and self.season.signup_end < date.today()
+        )
+        members = Member._base_manager.select_related("user").filter(pk__in=member_ids)
+        EmailSender(EmailEnum.WAITING_TO_ACTIVE_COURSE).send_emails(
+            (
+                [member.email, member.user.username] if member.user else [member.email],
+                {
+                    "full_name": f"{member.first_name} {member.last_name}",
+                    "course_name": self.name,
+                    "weekday": self.get_weekday_display(),
+                    "start_hour": self.start_hour.strftime("%Hh%M"),
+                    "with_next_course_warning": with_next_course_warning,
+                },
             )
+            for member in members
+        )
 
 
 class MedicEnum(Enum):
@@ -318,6 +760,144 @@ class OtherPayment(models.Model):
     comment = models.CharField(null=False, blank=False, max_length=100)
 
 
+# Letters NFKD leaves whole, spelled as typed on a keyboard
+LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss"})
+
+
+def normalize_search(value: str) -> str:
+    """Lowercase, unaccented and single-spaced version of value, for search."""
+    decomposed = unicodedata.normalize("NFKD", value.casefold().translate(LIGATURES))
+    return " ".join(
+        "".join(char for char in decomposed if not unicodedata.combining(char)).split()
+    )
+
+
+def _aggregate_subquery(queryset: models.QuerySet, aggregate, output_field):
+    """Aggregate a queryset already filtered on the outer row, as a subquery."""
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .annotate(_group=Value(1))
+            .values("_group")
+            .annotate(total=aggregate)
+            .values("total")[:1],
+            output_field=output_field,
+        ),
+        Value(0),
+        output_field=output_field,
+    )
+
+
+class PaymentQuerySet(models.QuerySet):
+    DETAILS = (
+        "season",
+        "user",
+        "payment_balance",
+        "ancv",
+        "sport_coupon",
+        "other_payment",
+        "cb_payment",
+    )
+
+    def with_details(self, relations: Iterable[str] | None = None) -> models.QuerySet:
+        """Load the relations PaymentSerializer needs, in a fixed number of queries.
+
+        `relations` restricts loading to the given ones, others are ignored.
+        """
+        wanted = set(
+            self.DETAILS + ("check_payment",) if relations is None else relations
+        )
+        queryset = self.select_related(
+            *(name for name in self.DETAILS if name in wanted)
+        )
+        if "check_payment" in wanted:
+            queryset = queryset.prefetch_related("check_payment")
+        return queryset
+
+    def with_balance(self) -> models.QuerySet:
+        """Annotate financial figures so that due, paid and due_detail need no query.
+
+        Computed annotations:
+        - courses_count, courses_price: active and cancelled courses of the members
+        - billed_members_count, billed_licenses_price: members charged for adhesion
+          and license in due (active course or validated)
+        - registered_members_count, licenses_count, licenses_price: same for
+          due_detail (any course or validated)
+        - cancel_refunds, sport_passes, checks_amount
+        - due_amount (not rounded), paid_amount, balance
+        """
+        members = Member.objects.filter(
+            user=OuterRef("user"), season=OuterRef("season")
+        )
+        active = Member.active_courses.through.objects.filter(
+            member__user=OuterRef("user"), member__season=OuterRef("season")
+        )
+        cancelled = Member.cancelled_courses.through.objects.filter(
+            member__user=OuterRef("user"), member__season=OuterRef("season")
+        )
+        with_active = Q(
+            Exists(Member.active_courses.through.objects.filter(member=OuterRef("pk")))
+        )
+        with_cancelled = Q(
+            Exists(
+                Member.cancelled_courses.through.objects.filter(member=OuterRef("pk"))
+            )
+        )
+        billed = members.filter(with_active | Q(is_validated=True))
+        registered = members.filter(with_active | with_cancelled | Q(is_validated=True))
+        integer: IntegerField = IntegerField()
+        floating: FloatField = FloatField()
+        queryset = self.select_related("season").annotate(
+            courses_count=_aggregate_subquery(active, Count("pk"), integer)
+            + _aggregate_subquery(cancelled, Count("pk"), integer),
+            courses_price=_aggregate_subquery(active, Sum("course__price"), integer)
+            + _aggregate_subquery(cancelled, Sum("course__price"), integer),
+            billed_members_count=_aggregate_subquery(billed, Count("pk"), integer),
+            billed_licenses_price=_aggregate_subquery(
+                billed, Sum("ffd_license"), integer
+            ),
+            registered_members_count=_aggregate_subquery(
+                registered, Count("pk"), integer
+            ),
+            licenses_count=_aggregate_subquery(
+                registered.filter(ffd_license__gt=0), Count("pk"), integer
+            ),
+            licenses_price=_aggregate_subquery(registered, Sum("ffd_license"), integer),
+            cancel_refunds=_aggregate_subquery(members, Sum("cancel_refund"), floating),
+            sport_passes=_aggregate_subquery(
+                members.filter(sport_pass__isnull=False), Count("pk"), integer
+            ),
+            checks_amount=_aggregate_subquery(
+                Check.objects.filter(payment=OuterRef("pk")), Sum("amount"), floating
+            ),
+        )
+        return queryset.annotate(
+            due_amount=Case(
+                When(
+                    courses_count__gte=F("season__discount_limit"),
+                    then=F("courses_price")
+                    * (Value(100.0) - F("season__discount_percent"))
+                    / Value(100.0),
+                ),
+                default=F("courses_price") * Value(1.0),
+                output_field=floating,
+            )
+            + F("billed_members_count") * 10
+            + F("billed_licenses_price")
+            - F("cancel_refunds")
+            - F("special_discount"),
+            paid_amount=F("cash")
+            + Coalesce(F("sport_coupon__amount"), 0, output_field=floating)
+            + Coalesce(F("ancv__amount"), 0, output_field=floating)
+            + Coalesce(F("cb_payment__amount"), 0, output_field=floating)
+            + Coalesce(F("other_payment__amount"), 0, output_field=floating)
+            + F("checks_amount")
+            + F("sport_passes") * F("season__pass_sport_amount"),
+        ).annotate(
+            balance=F("due_amount") - F("paid_amount") + F("refund"),
+        )
+
+
 class Payment(models.Model):
     season = models.ForeignKey(Season, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -333,8 +913,12 @@ class Payment(models.Model):
         null=False, default=0.0, validators=[MinValueValidator(0)]
     )
 
+    objects = models.Manager.from_queryset(PaymentQuerySet)()
+
     @property
     def sport_pass_count(self) -> int:
+        if hasattr(self, "sport_passes"):
+            return self.sport_passes
         count = 0
         for member in self.user.member_set.filter(season=self.season).all():
             if member.sport_pass:
@@ -343,6 +927,8 @@ class Payment(models.Model):
 
     @property
     def sport_pass_amount(self) -> int:
+        if hasattr(self, "sport_passes"):
+            return self.sport_passes * self.season.pass_sport_amount
         amount = 0
         for member in self.user.member_set.filter(season=self.season).all():
             if member.sport_pass:
@@ -351,6 +937,8 @@ class Payment(models.Model):
 
     @property
     def due(self) -> float:
+        if hasattr(self, "due_amount"):
+            return int(round(self.due_amount))
         due = 0.0
         total = 0
         members = self.user.member_set.filter(season=self.season).all()
@@ -374,27 +962,35 @@ class Payment(models.Model):
 
     @property
     def due_detail(self) -> list[str]:
-        members_count = 0
-        courses_count = 0
-        courses_price = 0
-        members = self.user.member_set.filter(season=self.season).all()
-        for member in members:
-            if member.is_validated or member.courses:
-                members_count += 1
-            for course in member.courses:
-                courses_count += 1
-                courses_price += course.price
+        if hasattr(self, "courses_count"):
+            members_count = self.registered_members_count  # type: ignore[attr-defined]
+            courses_count = self.courses_count
+            courses_price = self.courses_price  # type: ignore[attr-defined]
+            license_count = self.licenses_count  # type: ignore[attr-defined]
+            license_price = self.licenses_price  # type: ignore[attr-defined]
+            cancelled = self.cancel_refunds  # type: ignore[attr-defined]
+        else:
+            members_count = 0
+            courses_count = 0
+            courses_price = 0
+            members = self.user.member_set.filter(season=self.season).all()
+            for member in members:
+                if member.is_validated or member.courses:
+                    members_count += 1
+                for course in member.courses:
+                    courses_count += 1
+                    courses_price += course.price
+            licenses = [
+                member.ffd_license
+                for member in members
+                if member.ffd_license > 0 and (member.is_validated or member.courses)
+            ]
+            license_count = len(licenses)
+            license_price = sum(licenses)
+            cancelled = sum(member.cancel_refund for member in members)
         discount = 0
         if courses_count >= self.season.discount_limit:
             discount = int(round(courses_price * self.season.discount_percent / 100))
-        licenses = [
-            member.ffd_license
-            for member in members
-            if member.ffd_license > 0 and (member.is_validated or member.courses)
-        ]
-        license_count = len(licenses)
-        license_price = sum(licenses)
-        cancelled = sum(member.cancel_refund for member in members)
         info = [
             f"{members_count} adhésion(s): {10 * members_count}€",
             f"{courses_count} cours: {courses_price}€",
@@ -413,6 +1009,8 @@ class Payment(models.Model):
 
     @property
     def paid(self) -> float:
+        if hasattr(self, "paid_amount"):
+            return self.paid_amount
         paid = self.cash
         if hasattr(self, "sport_coupon"):
             paid += self.sport_coupon.amount
@@ -429,15 +1027,170 @@ class Payment(models.Model):
                 paid += member.sport_pass.amount
         return paid
 
+    @property
+    def ledger(self) -> "PaymentBalance":
+        """Stored financial figures, computed if missing."""
+        try:
+            return self.payment_balance
+        except PaymentBalance.DoesNotExist:
+            (self.payment_balance,) = PaymentBalance.objects.refresh(
+                Payment.objects.filter(pk=self.pk)
+            )
+            return self.payment_balance
+
     @transaction.atomic
     def save(self, *args, **kwargs) -> None:
         super().save(*args, **kwargs)
-        if self.paid >= self.due:
-            for member in Member.objects.filter(
-                user=self.user, season=self.season, is_validated=False
-            ).all():
-                member.is_validated = True
-                member.save()
+        (self.payment_balance,) = PaymentBalance.objects.refresh(
+            Payment.objects.filter(pk=self.pk)
+        )
+        if self.payment_balance.paid < self.payment_balance.due:
+            return
+        to_validate = Member.objects.filter(
+            user=self.user_id, season=self.season_id, is_validated=False
+        )
+        member_ids = list(to_validate.values_list("pk", flat=True))
+        if not member_ids:
+            return
+        Member.objects.filter(pk__in=member_ids).update(is_validated=True)
+        # Validated members are charged adhesion and license
+        (self.payment_balance,) = PaymentBalance.objects.refresh(
+            Payment.objects.filter(pk=self.pk)
+        )
+        members_validated.send(sender=Payment, payment=self, member_ids=member_ids)
+
+
+class PaymentBalanceManager(models.Manager["PaymentBalance"]):
+    _deferred = threading.local()
+
+    @contextmanager
+    def deferring(self) -> Iterator[None]:
+        """Within the block, signals only collect payments, refreshed once at exit."""
+        if getattr(self._deferred, "payment_ids", None) is not None:
+            yield
+            return
+        self._deferred.payment_ids = set()
+        try:
+            yield
+            payment_ids = self._deferred.payment_ids
+        finally:
+            self._deferred.payment_ids = None
+        if payment_ids:
+            self.refresh(Payment.objects.filter(pk__in=payment_ids))
+
+    def schedule(self, payments: PaymentQuerySet | Iterable[int]) -> None:
+        """Refresh now, or at the end of the deferring block if any."""
+        payment_ids = getattr(self._deferred, "payment_ids", None)
+        if payment_ids is None:
+            if not isinstance(payments, PaymentQuerySet):
+                payments = Payment.objects.filter(pk__in=payments)
+            self.refresh(payments)
+        elif isinstance(payments, PaymentQuerySet):
+            payment_ids.update(payments.values_list("pk", flat=True))
+        else:
+            payment_ids.update(payments)
+
+    def refresh(self, payments: PaymentQuerySet) -> list["PaymentBalance"]:
+        """Recompute and store the balance of the given payments.
+
+        Rows are upserted, so concurrent refreshes of a payment don't conflict."""
+        balances = [
+            PaymentBalance.from_payment(payment) for payment in payments.with_balance()
+        ]
+        # MySQL upserts on any unique key and rejects an explicit one
+        unique_fields = (
+            ["payment"]
+            if connections[self.db].features.supports_update_conflicts_with_target
+            else None
+        )
+        balances = self.bulk_create(
+            balances,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=[*PaymentBalance.COMPUTED_FIELDS, "updated"],
+        )
+        payment_ids = getattr(self._deferred, "payment_ids", None)
+        if payment_ids:
+            payment_ids.difference_update(balance.payment_id for balance in balances)
+        return balances
+
+    def drifted(self, payments: PaymentQuerySet) -> list["PaymentBalance"]:
+        """Return the stored balances that differ from a fresh computation.
+
+        Missing balances are not reported, they are computed on first read."""
+        stored = {
+            balance.payment_id: balance for balance in self.filter(payment__in=payments)
+        }
+        drifted = []
+        for payment in payments.with_balance():
+            expected = PaymentBalance.from_payment(payment)
+            current = stored.get(payment.pk)
+            if current is not None and any(
+                getattr(current, field) != getattr(expected, field)
+                for field in PaymentBalance.COMPUTED_FIELDS
+            ):
+                drifted.append(expected)
+        return drifted
+
+
+class PaymentBalance(models.Model):
+    """Denormalized financial figures of a Payment, kept up to date by signals."""
+
+    COMPUTED_FIELDS = (
+        "due",
+        "paid",
+        "refund",
+        "balance",
+        "due_detail",
+        "members_count",
+        "courses_count",
+        "courses_price",
+        "licenses_count",
+        "licenses_price",
+        "cancel_refunds",
+        "sport_pass_count",
+        "sport_pass_amount",
+    )
+
+    payment = models.OneToOneField(
+        Payment, related_name="payment_balance", on_delete=models.CASCADE
+    )
+    due = models.IntegerField(null=False, default=0)
+    paid = models.FloatField(null=False, default=0.0)
+    refund = models.FloatField(null=False, default=0.0)
+    balance = models.FloatField(null=False, default=0.0)
+    due_detail = models.JSONField(null=False, default=list)
+    members_count = models.PositiveIntegerField(null=False, default=0)
+    courses_count = models.PositiveIntegerField(null=False, default=0)
+    courses_price = models.PositiveIntegerField(null=False, default=0)
+    licenses_count = models.PositiveIntegerField(null=False, default=0)
+    licenses_price = models.PositiveIntegerField(null=False, default=0)
+    cancel_refunds = models.FloatField(null=False, default=0.0)
+    sport_pass_count = models.PositiveIntegerField(null=False, default=0)
+    sport_pass_amount = models.PositiveIntegerField(null=False, default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = PaymentBalanceManager()
+
+    @classmethod
+    def from_payment(cls, payment: Payment) -> "PaymentBalance":
+        """Build from a payment annotated with PaymentQuerySet.with_balance()."""
+        return cls(
+            payment=payment,
+            due=payment.due,
+            paid=payment.paid,
+            refund=payment.refund,
+            balance=payment.due - payment.paid + payment.refund,
+            due_detail=payment.due_detail,
+            members_count=payment.registered_members_count,  # type: ignore[attr-defined]
+            courses_count=payment.courses_count,  # type: ignore[attr-defined]
+            courses_price=payment.courses_price,  # type: ignore[attr-defined]
+            licenses_count=payment.licenses_count,  # type: ignore[attr-defined]
+            licenses_price=payment.licenses_price,  # type: ignore[attr-defined]
+            cancel_refunds=payment.cancel_refunds,  # type: ignore[attr-defined]
+            sport_pass_count=payment.sport_pass_count,
+            sport_pass_amount=payment.sport_pass_amount,
+        )
 
 
 class CBPayment(models.Model):
@@ -529,6 +1282,13 @@ class PersonModel(models.Model):
         validators=[RegexValidator(r"\d{10}")],
         max_length=10,
     )
+    # Normalized "first last" and "last first", for indexed prefix search
+    search_name = models.CharField(
+        max_length=61, blank=True, default="", db_index=True, editable=False
+    )
+    search_name_reverse = models.CharField(
+        max_length=61, blank=True, default="", db_index=True, editable=False
+    )
 
     class Meta:
         abstract = True
@@ -540,8 +1300,31 @@ class PersonModel(models.Model):
         self.first_name = self.first_name.title()
         self.last_name = self.last_name.title()
         self.email = self.email.lower()
+        first_name = normalize_search(self.first_name)
+        last_name = normalize_search(self.last_name)
+        self.search_name = f"{first_name} {last_name}"
+        self.search_name_reverse = f"{last_name} {first_name}"
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"first_name", "last_name"} & set(
+            update_fields
+        ):
+            kwargs["update_fields"] = {
+                *update_fields,
+                "search_name",
+                "search_name_reverse",
+            }
         super().save(*args, **kwargs)
 
+    @classmethod
+    def search_filter(cls, search: str) -> Q:
+        """Prefix match on first then last name, or last then first name."""
+        search = normalize_search(search)
+        # Columns are already normalized: case-insensitive LIKE keeps using the
+        # index with MySQL collations, where LIKE BINARY would not.
+        return Q(search_name__istartswith=search) | Q(
+            search_name_reverse__istartswith=search
+        )
+
 
 class ContactManager(models.Manager):
     def clean_orphan(self) -> None:
@@ -567,6 +1350,18 @@ class MemberManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(user__isnull=False)
 
+    def attach_payments(self, members: Sequence) -> None:
+        """Fetch in one query the payments of members, with their stored balance."""
+        payments = {
+            (payment.user_id, payment.season_id): payment
+            for payment in Payment.objects.with_details().filter(
+                user__in={member.user_id for member in members},
+                season__in={member.season_id for member in members},
+            )
+        }
+        for member in members:
+            member._payment = payments.get((member.user_id, member.season_id))
+
 
 class Member(PersonModel):
     created = models.DateTimeField(auto_now_add=True)
@@ -608,6 +1403,9 @@ class Member(PersonModel):
 
     @property
     def payment(self) -> Payment:
+        payment = getattr(self, "_payment", None)
+        if payment is not None:
+            return payment
         return Payment.objects.get(user=self.user, season=self.season)
 
     @property
@@ -620,12 +1418,70 @@ class Member(PersonModel):
 
 
 @receiver(post_delete, sender=Member)
-def post_delete_member(sender, instance, *args, **kwargs):
+def post_delete_member(sender, instance, origin=None, *args, **kwargs):
     if instance.documents:
         instance.documents.delete()
     if instance.sport_pass:
         instance.sport_pass.delete()
-    Course.objects.manage_waiting_lists()
+    # Through rows are deleted without m2m_changed signal
+    Course.objects.recount_seats(getattr(instance, "_course_ids", []))
+    Course.objects.schedule_queue_update(getattr(instance, "_course_ids", []))
+    if _deleted_by_cascade(sender, origin):
+        return
+    PaymentBalance.objects.schedule(
+        Payment.objects.filter(user=instance.user_id, season=instance.season_id)
+    )
+
+
+@receiver(pre_delete, sender=Member)
+def stash_member_courses(sender, instance, *args, **kwargs):
+    # Through rows are gone once the member is deleted
+    instance._course_ids = list(instance.active_courses.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=User)
+def stash_user_courses(sender, instance, *args, **kwargs):
+    # Its members are kept without user, and give their seats back
+    instance._course_ids = list(
+        Course.objects.filter(members__user=instance)
+        .distinct()
+        .values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=User)
+def release_user_seats(sender, instance, *args, **kwargs):
+    course_ids = getattr(instance, "_course_ids", [])
+    Course.objects.recount_seats(course_ids)
+    Course.objects.schedule_queue_update(course_ids)
+
+
+@receiver(m2m_changed, sender=Member.active_courses.through)
+def track_seats(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and not reverse:
+        instance._course_ids = list(
+            instance.active_courses.values_list("pk", flat=True)
+        )
+    if action in ("post_add", "post_remove"):
+        course_ids = [instance.pk] if reverse else pk_set
+    elif action == "post_clear":
+        course_ids = [instance.pk] if reverse else getattr(instance, "_course_ids", [])
+    else:
+        return
+    Course.objects.recount_seats(course_ids)
+    if action != "post_add":
+        Course.objects.schedule_queue_update(course_ids)
+
+
+def _member_payments(*args, **kwargs) -> PaymentQuerySet:
+    """Payments of the members matching the filters (user and season wise)."""
+    return Payment.objects.filter(
+        Exists(
+            Member.objects.filter(
+                user=OuterRef("user"), season=OuterRef("season")
+            ).filter(*args, **kwargs)
+        )
+    )
 
 
 class WaitingList(models.Model):
@@ -635,3 +1491,388 @@ class WaitingList(models.Model):
 
     class Meta:
         unique_together = ("course", "member")
+
+
+class EmailOutboxManager(models.Manager["EmailOutbox"]):
+    def enqueue(self, email_type: str, mail: EmailMultiAlternatives) -> None:
+        """Store the email once the current transaction is committed."""
+        html = next(
+            (
+                content
+                for content, mimetype in mail.alternatives
+                if mimetype == "text/html"
+            ),
+            "",
+        )
+        transaction.on_commit(
+            lambda: self.create(
+                email_type=email_type,
+                to=list(mail.to),
+                subject=str(mail.subject),
+                body=str(mail.body),
+                html=str(html),
+            )
+        )
+
+    def send_pending(self, batch_size: int, max_attempts: int) -> tuple[int, int]:
+        """Send the due emails of one batch, return how many were sent and failed.
+
+        The batch is claimed in a short transaction, then sent without holding
+        any lock. If the mail server can't be reached, the rest of the batch is
+        released without counting an attempt."""
+        with transaction.atomic():
+            batch = list(
+                self.select_for_update(skip_locked=True)
+                .filter(
+                    status=EmailOutbox.StatusEnum.PENDING,
+                    next_attempt__lte=timezone.now(),
+                )
+                .order_by("next_attempt", "id")[:batch_size]
+            )
+            # Skipped by other workers, and retried if this one dies
+            self.filter(pk__in=[email.pk for email in batch]).update(
+                next_attempt=timezone.now() + EmailOutbox.CLAIM_DELAY
+            )
+        sent = failed = 0
+        connection = get_connection()
+        for index, email in enumerate(batch):
+            # Kept open for the whole batch, unless a send failed
+            try:
+                connection.open()
+            except Exception as error:
+                _logger.warning("Serveur mail injoignable: %s", error)
+                self.filter(pk__in=[email.pk for email in batch[index:]]).update(
+                    next_attempt=timezone.now()
+                )
+                break
+            try:
+                connection.send_messages([email.build()])
+            except Exception as error:
+                email.retry_later(str(error), max_attempts)
+                failed += 1
+                connection.close()
+            else:
+                email.status = EmailOutbox.StatusEnum.SENT
+                email.sent = timezone.now()
+                sent += 1
+            email.attempts += 1
+            email.save(
+                update_fields=[
+                    "status",
+                    "attempts",
+                    "next_attempt",
+                    "last_error",
+                    "sent",
+                ]
+            )
+        connection.close()
+        return sent, failed
+
+
+class EmailOutbox(models.Model):
+    """Emails waiting to be sent by the send_outbox command."""
+
+    class StatusEnum(models.TextChoices):
+        PENDING = "pending", "En attente"
+        SENT = "sent", "Envoyé"
+        FAILED = "failed", "Échec"
+
+    RETRY_DELAY = timedelta(minutes=1)
+    # Sending a batch takes less, else it may be sent twice
+    CLAIM_DELAY = timedelta(minutes=10)
+
+    email_type = models.CharField(max_length=50)
+    to = models.JSONField(default=list)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html = models.TextField(blank=True, default="")
+    status = models.CharField(
+        max_length=7, choices=StatusEnum.choices, default=StatusEnum.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True)
+
+    objects = EmailOutboxManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt"])]
+
+    def build(self) -> EmailMultiAlternatives:
+        mail = EmailMultiAlternatives(
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=self.to,
+            reply_to=[settings.DEFAULT_FROM_EMAIL],
+            subject=self.subject,
+            body=self.body,
+        )
+        if self.html:
+            mail.attach_alternative(self.html, "text/html")
+        return mail
+
+    def retry_later(self, error: str, max_attempts: int) -> None:
+        """Delay the next attempt exponentially, or give up after max_attempts."""
+        _logger.warning("Echec de l'envoi du mail %s: %s", self.pk, error)
+        self.last_error = error
+        if self.attempts + 1 >= max_attempts:
+            self.status = EmailOutbox.StatusEnum.FAILED
+            return
+        self.next_attempt = timezone.now() + self.RETRY_DELAY * 2**self.attempts
+
+
+class Announcement(models.Model):
+    """Email sent to the members of a season, a course or a teacher's courses."""
+
+    class StatusEnum(models.TextChoices):
+        SENDING = "sending", "En cours"
+        PAUSED = "paused", "En pause"
+        DONE = "done", "Terminé"
+
+    season = models.ForeignKey(Season, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, null=True, blank=True, on_delete=models.CASCADE)
+    teacher = models.ForeignKey(
+        Teacher, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    status = models.CharField(
+        max_length=7, choices=StatusEnum.choices, default=StatusEnum.SENDING
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+    def add_recipients(self) -> int:
+        """Add the members' emails and their users' ones, once each."""
+        members = Member.objects.filter(season_id=self.season_id)
+        if self.course_id:
+            members = members.filter(active_courses=self.course_id)
+        if self.teacher_id:
+            members = members.filter(active_courses__teacher=self.teacher_id)
+        emails = {
+            address.lower()
+            for addresses in members.values_list("email", "user__username").distinct()
+            for address in addresses
+            if address
+        }
+        AnnouncementRecipient.objects.bulk_create(
+            (
+                AnnouncementRecipient(announcement=self, email=email)
+                for email in sorted(emails)
+            ),
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        return len(emails)
+
+    def resume(self) -> None:
+        """Send again, failed recipients included."""
+        self.recipients.filter(status=AnnouncementRecipient.StatusEnum.FAILED).update(
+            status=AnnouncementRecipient.StatusEnum.PENDING, error=""
+        )
+        self.status = Announcement.StatusEnum.SENDING
+        self.save(update_fields=["status"])
+
+    def pause(self) -> None:
+        """Stop after the batch being sent. Pending recipients wait for resume."""
+        Announcement.objects.filter(
+            pk=self.pk, status=Announcement.StatusEnum.SENDING
+        ).update(status=Announcement.StatusEnum.PAUSED)
+        self.refresh_from_db(fields=["status"])
+
+    def send_batch(self, batch_size: int | None = None) -> tuple[int, int]:
+        """Send to a batch of pending recipients, return the sent and failed counts.
+
+        The status is read again before each batch, so a pause stops the sending.
+        Batches are spaced by the send_announcements worker, that keeps all the
+        announcements within one messages-per-minute budget."""
+        batch_size = batch_size or settings.ANNOUNCEMENT_BATCH_SIZE
+        sent = failed = 0
+        with transaction.atomic():
+            if Announcement.objects.filter(
+                pk=self.pk, status=Announcement.StatusEnum.SENDING
+            ).exists():
+                pending = self.recipients.filter(
+                    status=AnnouncementRecipient.StatusEnum.PENDING
+                )
+                batch = list(
+                    pending.select_for_update(skip_locked=True).order_by("id")[
+                        :batch_size
+                    ]
+                )
+                if batch:
+                    sent, failed = self._send_to(batch)
+                if not pending.exists():
+                    Announcement.objects.filter(
+                        pk=self.pk, status=Announcement.StatusEnum.SENDING
+                    ).update(status=Announcement.StatusEnum.DONE)
+        self.refresh_from_db(fields=["status"])
+        return sent, failed
+
+    def _send_to(self, batch: list["AnnouncementRecipient"]) -> tuple[int, int]:
+        """Render the message once and send it over one connection."""
+        mail = EmailSender(EmailEnum.ANNOUNCEMENT).build_email(
+            [], subject=self.subject, message=self.message
+        )
+        mail_connection = get_connection()
+        sent = failed = 0
+        for recipient in batch:
+            # The first send opens the connection, kept for the whole batch
+            try:
+                mail_connection.open()
+                mail_connection.send_messages([recipient.build(mail)])
+            except Exception as error:
+                _logger.warning(
+                    "Echec de l'envoi de l'annonce %s à %s: %s",
+                    self.pk,
+                    recipient.email,
+                    error,
+                )
+                recipient.status = AnnouncementRecipient.StatusEnum.FAILED
+                recipient.error = str(error)
+                failed += 1
+            else:
+                recipient.status = AnnouncementRecipient.StatusEnum.SENT
+                recipient.sent = timezone.now()
+                sent += 1
+        mail_connection.close()
+        AnnouncementRecipient.objects.bulk_update(batch, ["status", "error", "sent"])
+        return sent, failed
+
+
+class AnnouncementRecipient(models.Model):
+    class StatusEnum(models.TextChoices):
+        PENDING = "pending", "En attente"
+        SENT = "sent", "Envoyé"
+        FAILED = "failed", "Échec"
+
+    announcement = models.ForeignKey(
+        Announcement, on_delete=models.CASCADE, related_name="recipients"
+    )
+    email = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=7, choices=StatusEnum.choices, default=StatusEnum.PENDING
+    )
+    error = models.TextField(blank=True, default="")
+    sent = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = ("announcement", "email")
+
+    def build(self, mail: EmailMultiAlternatives) -> EmailMultiAlternatives:
+        """Copy of the rendered announcement, addressed to this recipient only."""
+        return EmailMultiAlternatives(
+            from_email=mail.from_email,
+            to=[self.email],
+            reply_to=mail.reply_to,
+            subject=mail.subject,
+            body=mail.body,
+            alternatives=mail.alternatives,
+        )
+
+
+def _deleted_by_cascade(sender, origin) -> bool:
+    """Whether the deletion cascades from another model: a payment, its season or
+    its user. Their payments are deleted too, and refreshing them would insert
+    balances the cascade already collected."""
+    return (
+        origin is not None
+        and not isinstance(origin, sender)
+        and getattr(origin, "model", None) is not sender
+    )
+
+
+# Keep PaymentBalance rows up to date
+@receiver(post_save, sender=Check)
+@receiver(post_delete, sender=Check)
+@receiver(post_save, sender=CBPayment)
+@receiver(post_delete, sender=CBPayment)
+@receiver(post_save, sender=Ancv)
+@receiver(post_delete, sender=Ancv)
+@receiver(post_save, sender=SportCoupon)
+@receiver(post_delete, sender=SportCoupon)
+def refresh_payment_balance(sender, instance, *args, **kwargs):
+    if _deleted_by_cascade(sender, kwargs.get("origin")):
+        return
+    PaymentBalance.objects.schedule([instance.payment_id])
+
+
+@receiver(post_save, sender=OtherPayment)
+def refresh_other_payment_balance(sender, instance, *args, **kwargs):
+    PaymentBalance.objects.schedule(Payment.objects.filter(other_payment=instance))
+
+
+@receiver(post_save, sender=SportPass)
+def refresh_sport_pass_balance(sender, instance, *args, **kwargs):
+    PaymentBalance.objects.schedule(_member_payments(sport_pass=instance))
+
+
+@receiver(post_save, sender=Member)
+def refresh_member_balance(sender, instance, *args, **kwargs):
+    PaymentBalance.objects.schedule(_member_payments(pk=instance.pk))
+
+
+@receiver(post_save, sender=Course)
+def refresh_course_balance(sender, instance, created, *args, **kwargs):
+    if not created:
+        PaymentBalance.objects.schedule(
+            _member_payments(Q(active_courses=instance) | Q(cancelled_courses=instance))
+        )
+
+
+@receiver(pre_delete, sender=OtherPayment)
+@receiver(pre_delete, sender=SportPass)
+@receiver(pre_delete, sender=Course)
+def stash_payments_before_delete(sender, instance, *args, **kwargs):
+    """Related payments can't be found anymore after deletion."""
+    if sender is OtherPayment:
+        payments = Payment.objects.filter(other_payment=instance)
+    elif sender is SportPass:
+        payments = _member_payments(sport_pass=instance)
+    else:
+        payments = _member_payments(
+            Q(active_courses=instance) | Q(cancelled_courses=instance)
+        )
+    instance._payment_ids = list(payments.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=OtherPayment)
+@receiver(post_delete, sender=SportPass)
+@receiver(post_delete, sender=Course)
+def refresh_payments_after_delete(sender, instance, origin=None, *args, **kwargs):
+    if _deleted_by_cascade(sender, origin):
+        return
+    PaymentBalance.objects.schedule(
+        Payment.objects.filter(pk__in=getattr(instance, "_payment_ids", []))
+    )
+
+
+@receiver(m2m_changed, sender=Member.active_courses.through)
+@receiver(m2m_changed, sender=Member.cancelled_courses.through)
+def refresh_courses_balance(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        instance._payment_ids = list(
+            _member_payments(
+                Q(active_courses=instance) | Q(cancelled_courses=instance)
+            ).values_list("pk", flat=True)
+        )
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        payments = _member_payments(pk=instance.pk)
+    elif action == "post_clear":
+        payments = Payment.objects.filter(pk__in=getattr(instance, "_payment_ids", []))
+    else:
+        payments = _member_payments(pk__in=pk_set)
+    PaymentBalance.objects.schedule(payments)
+
+
+@receiver(post_save, sender=GeneralSettings)
+def forget_general_settings(sender, *args, **kwargs):
+    invalidate(GENERAL_SETTINGS_KEY)
+
+
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def forget_current_season(sender, *args, **kwargs):
+    invalidate(CURRENT_SEASON_KEY)
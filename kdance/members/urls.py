@@ -20,6 +20,8 @@ from django.urls import include, path
 from rest_framework import routers
 
 from members.api.views import (
+    AnnouncementViewSet,
+    ArchiveViewSet,
     CheckViewSet,
     CourseViewSet,
     GeneralSettingsViewSet,
@@ -64,6 +66,8 @@ class SingletonRouter(routers.SimpleRouter):
 
 
 router = routers.DefaultRouter()
+router.register(r"announcements", AnnouncementViewSet, basename="api-announcements")
+router.register(r"archives", ArchiveViewSet, basename="api-archives")
 router.register(r"checks", CheckViewSet, basename="api-checks")
 router.register(r"courses", CourseViewSet, basename="api-courses")
 router.register(r"members", MemberViewSet, basename="api-members")
@@ -62,19 +62,21 @@ def _get_total_due(request_user: User) -> int:
     if isinstance(request_user, AnonymousUser):
         raise Http404
 
-    current_payment = Payment.objects.filter(
-        user=request_user, season__is_current=True
-    ).first()
+    current_payment = (
+        Payment.objects.select_related("payment_balance")
+        .filter(user=request_user, season__is_current=True)
+        .first()
+    )
     if not current_payment:
         raise Http404
 
-    return current_payment.due - current_payment.paid + current_payment.refund
+    return current_payment.ledger.balance
 
 
 @require_http_methods(["GET"])
 @login_required()
 def index(request: HttpRequest) -> HttpResponse:
-    current_season = Season.objects.filter(is_current=True).first()
+    current_season = Season.objects.current()
     general_settings = GeneralSettings.get_solo()
     return render(
         request,
@@ -109,7 +111,7 @@ def checkout(request: HttpRequest) -> HttpResponse:
         "pages/checkout.html",
         context={
             "user": request.user,
-            "season": Season.objects.get(is_current=True),
+            "season": Season.objects.current(),
         },
     )
 
@@ -159,7 +161,7 @@ def session_status(request: HttpRequest) -> HttpResponse:
             hosted_checkout_status.created_payment_output.payment.payment_output.amount_of_money.amount
             or 0
         )
-        current_season = Season.objects.get(is_current=True)
+        current_season = Season.objects.current()
         current_payment = Payment.objects.get(season=current_season, user=request.user)  # type: ignore [misc]
         if hasattr(current_payment, "cb_payment"):
             current_payment.cb_payment.amount += amount / 100
@@ -234,7 +236,7 @@ def member(request: HttpRequest) -> HttpResponse:
         "pages/member.html",
         context={
             "user": request.user,
-            "season": Season.objects.get(is_current=True),
+            "season": Season.objects.current(),
             "is_teacher": _is_teacher(request),
         },
     )
@@ -276,7 +278,7 @@ def member_mgmt(request: HttpRequest) -> HttpResponse:
             "pages/member_mgmt.html",
             context={
                 "user": request.user,
-                "season": Season.objects.get(is_current=True),
+                "season": Season.objects.current(),
                 "is_teacher": _is_teacher(request),
             },
         )
@@ -316,7 +318,7 @@ def list_dl(request: HttpRequest) -> HttpResponse:
             "pages/list_dl.html",
             context={
                 "user": request.user,
-                "season": Season.objects.get(is_current=True),
+                "season": Season.objects.current(),
                 "is_teacher": _is_teacher(request),
             },
         )
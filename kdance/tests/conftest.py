@@ -2,6 +2,7 @@ from unittest.mock import Mock
 import pytest
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from members.models import (
     Course,
     Documents,
@@ -21,6 +22,12 @@ class CawlMock(Mock):
         return Mock()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Cached settings and season would outlive the rolled back test data
+    cache.clear()
+
+
 @pytest.fixture(autouse=True)
 def mock_cawl(monkeypatch):
     monkeypatch.setattr(
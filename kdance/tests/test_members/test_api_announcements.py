@@ -0,0 +1,129 @@
+"""Tests related to Announcement API view."""
+
+import pytest
+
+from django.core import mail
+from django.urls import reverse
+from parameterized import parameterized
+
+from members.api.views import AnnouncementViewSet
+from members.models import (
+    Announcement,
+    AnnouncementRecipient,
+    Member,
+    Season,
+    Teacher,
+)
+from tests.authentication import AuthenticatedAction, AuthTestCase
+from tests.data_tests import MEMBER, SEASON
+
+
+@pytest.mark.django_db
+class TestAnnouncementApiView(AuthTestCase):
+    view_function = AnnouncementViewSet
+
+    @pytest.fixture(autouse=True)
+    def set_members(self, mock_season, mock_course):
+        self._season = mock_season
+        self._course = mock_course
+        # Same email as the user: deduplicated
+        member, _ = Member.objects.get_or_create(
+            **{**MEMBER, "email": self.testuser.email},
+            user=self.testuser,
+            season=mock_season,
+        )
+        member.active_courses.add(mock_course)
+        Member.objects.get_or_create(
+            **{**MEMBER, "first_name": "Plouf", "email": "plouf@plop.fr"},
+            user=self.testuser,
+            season=mock_season,
+        )
+
+    @parameterized.expand(
+        [
+            ("get", 403, 200),
+            ("post", 403, 400),
+            ("put", 403, 405),
+            ("patch", 403, 405),
+            ("delete", 403, 405),
+        ]
+    )
+    def test_permissions(self, method, user_status, superuser_status):
+        assert self.users_have_permission(
+            method=method,
+            user_status=user_status,
+            superuser_status=superuser_status,
+            urls=(reverse("api-announcements-list"), AnnouncementViewSet),
+        )
+
+    def test_authentication_mandatory(self):
+        assert self.anonymous_has_permission(
+            "get", 403, reverse("api-announcements-list")
+        )
+
+    def _create(self, **data) -> dict:
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.post(
+                reverse("api-announcements-list"),
+                {
+                    "season": self._season.id,
+                    "subject": "Gala",
+                    "message": "Le gala aura lieu le 21 juin.",
+                    **data,
+                },
+            )
+        assert response.status_code == 201, response.json()
+        return response.json()
+
+    def test_create_season(self):
+        announcement = self._create()
+        assert announcement["status"] == Announcement.StatusEnum.SENDING
+        assert (announcement["pending"], announcement["sent"]) == (3, 0)
+        assert sorted(
+            AnnouncementRecipient.objects.values_list("email", flat=True)
+        ) == sorted(["plouf@plop.fr", self.testuser.email, self.testuser.username])
+        assert len(mail.outbox) == 0
+
+    def test_create_course(self):
+        assert self._create(course=self._course.id)["pending"] == 2
+        teacher, _ = Teacher.objects.get_or_create(name="Prof")
+        assert self._create(teacher=teacher.id)["pending"] == 0
+
+    def test_create_course_other_season(self):
+        other = Season.objects.create(**SEASON, year="1899-1900")
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.post(
+                reverse("api-announcements-list"),
+                {
+                    "season": other.id,
+                    "course": self._course.id,
+                    "subject": "Gala",
+                    "message": "Plop",
+                },
+            )
+        assert response.status_code == 400
+        assert response.json() == {
+            "course": ["Ce cours n'appartient pas à cette saison."]
+        }
+
+    def test_pause_resume(self):
+        announcement = self._create()
+        url = reverse("api-announcements-pause", kwargs={"pk": announcement["id"]})
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.post(url)
+        assert response.json()["status"] == Announcement.StatusEnum.PAUSED
+        assert Announcement.objects.get().send_batch() == (0, 0)
+        url = reverse("api-announcements-resume", kwargs={"pk": announcement["id"]})
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.post(url)
+            assert response.json()["status"] == Announcement.StatusEnum.SENDING
+            # Already sending
+            assert self.client.post(url).status_code == 400
+        assert Announcement.objects.get().send_batch() == (3, 0)
+        url = reverse("api-announcements-recipients", kwargs={"pk": announcement["id"]})
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(url, {"status": "sent"})
+        assert [recipient["email"] for recipient in response.json()] == sorted(
+            ["plouf@plop.fr", self.testuser.email, self.testuser.username]
+        )
+        assert len(mail.outbox) == 3
@@ -0,0 +1,172 @@
+"""Tests related to Archive API view."""
+
+import json
+
+from unittest.mock import patch
+
+import pytest
+
+from django.urls import reverse
+from parameterized import parameterized
+
+from members.api.views import ArchiveViewSet
+from members.archives import (
+    SCHEMA_VERSION,
+    archive_path,
+    export_season,
+    read_header,
+)
+from members.models import (
+    Ancv,
+    CBPayment,
+    Contact,
+    Member,
+    OtherPayment,
+    Payment,
+    Season,
+    SportCoupon,
+    SportPass,
+)
+from tests.authentication import AuthenticatedAction, AuthTestCase
+from tests.data_tests import MEMBER
+
+
+@pytest.mark.django_db
+class TestArchiveApiView(AuthTestCase):
+    view_function = ArchiveViewSet
+
+    @pytest.fixture(autouse=True)
+    def set_archive(self, settings, tmp_path, mock_season, mock_course):
+        settings.SEASON_ARCHIVE_DIR = tmp_path
+        self._season = mock_season
+        member, _ = Member.objects.get_or_create(
+            **{**MEMBER, "first_name": "Hélène"},
+            user=self.testuser,
+            season=mock_season,
+        )
+        member.active_courses.add(mock_course)
+        contact, _ = Contact.objects.get_or_create(
+            first_name="Jean",
+            last_name="Dupont",
+            email="jean@test.com",
+            phone="0123456789",
+            contact_type=Contact.ContactEnum.RESPONSIBLE,
+        )
+        member.contacts.add(contact)
+        member.sport_pass = SportPass.objects.create(code="PASS")
+        member.save()
+        payment = Payment.objects.get(user=self.testuser, season=mock_season)
+        payment.other_payment = OtherPayment.objects.create(amount=5, comment="Bon")
+        payment.save()
+        CBPayment.objects.update_or_create(payment=payment, defaults={"amount": 10})
+        SportCoupon.objects.update_or_create(
+            payment=payment, defaults={"amount": 10, "count": 1}
+        )
+        Ancv.objects.update_or_create(
+            payment=payment, defaults={"amount": 10, "count": 2}
+        )
+        export_season(mock_season)
+
+    @parameterized.expand(
+        [
+            ("get", 403, 200),
+            ("post", 403, 405),
+            ("put", 403, 405),
+            ("patch", 403, 405),
+            ("delete", 403, 405),
+        ]
+    )
+    def test_permissions(self, method, user_status, superuser_status):
+        assert self.users_have_permission(
+            method=method,
+            user_status=user_status,
+            superuser_status=superuser_status,
+            urls=(reverse("api-archives-list"), ArchiveViewSet),
+        )
+
+    def test_authentication_mandatory(self):
+        assert self.anonymous_has_permission("get", 403, reverse("api-archives-list"))
+
+    def test_list(self):
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(reverse("api-archives-list"))
+        assert response.status_code == 200
+        (archive,) = response.json()
+        assert archive["year"] == self._season.year
+        assert archive["schema"] == SCHEMA_VERSION
+        assert archive["size"] == archive_path(self._season.year).stat().st_size
+
+    def _records(self, **params) -> list[dict]:
+        url = reverse("api-archives-detail", kwargs={"year": self._season.year})
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(url, params)
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        return [json.loads(line) for line in response.streaming_content]
+
+    def test_retrieve(self):
+        records = self._records()
+        assert {record["type"] for record in records} == {
+            "course",
+            "member",
+            "member_course",
+            "contact",
+            "member_contact",
+            "payment",
+            "other_payment",
+            "cb_payment",
+            "sport_coupon",
+            "ancv",
+            "sport_pass",
+        }
+        (member,) = [record["data"] for record in records if record["type"] == "member"]
+        assert member["first_name"] == "Hélène"
+        assert member["user_email"] == self.testuser.email
+        assert "search_name" not in member
+        (link,) = [
+            record["data"] for record in records if record["type"] == "member_course"
+        ]
+        assert (link["member_id"], link["status"]) == (member["id"], "active")
+        (sport_pass,) = [
+            record["data"] for record in records if record["type"] == "sport_pass"
+        ]
+        assert (sport_pass["id"], sport_pass["code"]) == (
+            member["sport_pass_id"],
+            "PASS",
+        )
+        (ancv,) = [record["data"] for record in records if record["type"] == "ancv"]
+        assert (ancv["amount"], ancv["count"]) == (10, 2)
+
+    def test_retrieve_filtered(self):
+        assert {record["type"] for record in self._records(type="course")} == {"course"}
+        (found,) = self._records(search="helene")
+        assert found["data"]["first_name"] == "Hélène"
+        (found,) = self._records(search="dupont j")
+        assert found["type"] == "contact"
+
+    def test_retrieve_unknown(self):
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(
+                reverse("api-archives-detail", kwargs={"year": "1800-1801"})
+            )
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Archive introuvable."
+
+
+@pytest.mark.django_db
+def test_export_season_kept(settings, tmp_path, mock_season):
+    settings.SEASON_ARCHIVE_DIR = tmp_path
+    path = export_season(mock_season)
+    Season.objects.filter(pk=mock_season.pk).update(discount_limit=42)
+    assert export_season(mock_season) == path
+    assert read_header(mock_season.year)["season"]["discount_limit"] == 2
+    assert not list(tmp_path.glob("*.partial"))
+
+
+@pytest.mark.django_db
+def test_export_season_failed(settings, tmp_path, mock_season):
+    settings.SEASON_ARCHIVE_DIR = tmp_path
+    with patch("members.archives._records", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            export_season(mock_season)
+    assert not list(tmp_path.iterdir())
@@ -4,16 +4,20 @@ from datetime import time
 
 import pytest
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from parameterized import parameterized
 
 from members.api.views import CourseViewSet
 from members.models import (
     Course,
+    Member,
     Season,
+    Teacher,
 )
 from tests.authentication import AuthenticatedAction, AuthTestCase
-from tests.data_tests import SEASON
+from tests.data_tests import COURSE, MEMBER, SEASON
 
 
 @pytest.mark.django_db
@@ -68,6 +72,50 @@ class TestCourseApiView(AuthTestCase):
         self._kwargs = {"pk": self._course.pk} if with_pk else {}
         assert self.anonymous_has_permission(method, 403)
 
+    def test_get_fields(self):
+        self._kwargs = {"pk": self._course.pk}
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(
+                self.view_url, {"fields": "id,name,season", "exclude": "season.year"}
+            )
+            assert response.status_code == 200, response
+        assert set(response.json()) == {"id", "name", "season"}
+        assert "year" not in response.json()["season"]
+        assert "is_current" in response.json()["season"]
+
+    def _list_queries(self) -> int:
+        with AuthenticatedAction(self.client, self.super_testuser):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.view_url, {"season": self._season.pk})
+            assert response.status_code == 200, response
+        return len(context.captured_queries)
+
+    def test_get_list_queries(self):
+        self._kwargs = {}
+        queries = self._list_queries()
+        teacher = Teacher.objects.create(name="Prof")
+        for i in range(5):
+            course = Course.objects.create(
+                **{**COURSE, "name": f"Course {i}", "capacity": 1},
+                season=self._season,
+                teacher=teacher,
+            )
+            member = Member.objects.create(
+                **{**MEMBER, "first_name": f"Plip{i}"},
+                user=self.testuser,
+                season=self._season,
+            )
+            member.active_courses.add(course)
+            member.waiting_courses.add(self._course)
+        assert self._list_queries() == queries
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(self.view_url, {"season": self._season.pk})
+        courses = {course["name"]: course for course in response.json()}
+        assert courses[COURSE["name"]]["waiting"] == 5
+        assert not courses[COURSE["name"]]["is_complete"]
+        assert courses["Course 0"]["is_complete"]
+        assert courses["Course 0"]["teacher"]["name"] == "Prof"
+
     def test_post(self):
         data = {
             "name": "Chenille",
@@ -234,6 +282,40 @@ class TestCoursesCopyApiView(AuthTestCase):
             assert getattr(new_course, attr) == getattr(self._course, attr)
         assert new_course.season == new_season
 
+    def test_copy_season_skipped(self):
+        new_season = Season.objects.create(
+            **SEASON,
+            year="2000-2001",
+        )
+        Course.objects.create(**{**COURSE, "season": new_season, "price": 1})
+        for i in range(10):
+            Course.objects.create(
+                **{**COURSE, "name": f"Salsa {i}", "season": self._season, "price": 99}
+            )
+        data = {
+            "from_season": self._season.pk,
+            "to_season": new_season.pk,
+            "price_increase": 10,
+            "capacity": 20,
+        }
+        with AuthenticatedAction(self.client, self.super_testuser):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    self.view_url, data=data, content_type="application/json"
+                )
+            assert response.status_code == 200, response
+        inserts = [q for q in queries if q["sql"].startswith("INSERT")]
+        assert len(inserts) == 1
+        answer = response.json()
+        assert [course["id"] for course in answer["skipped"]] == [self._course.pk]
+        assert len(answer["courses"]) == 11
+        copies = Course.objects.filter(season=new_season, name__startswith="Salsa")
+        assert copies.count() == 10
+        for course in copies:
+            assert course.price == 109
+            assert course.capacity == 20
+        assert Course.objects.get(season=new_season, name=COURSE["name"]).price == 1
+
     @parameterized.expand([True, False])
     def test_copy_season_error(self, is_from_ok):
         data = {
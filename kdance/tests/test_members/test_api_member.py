@@ -4,6 +4,10 @@ from datetime import datetime, timezone
 
 import pytest
 
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from parameterized import parameterized
 
@@ -12,9 +16,12 @@ from members.models import (
     Course,
     Documents,
     Member,
+    Payment,
     Season,
+    Teacher,
 )
 from tests.authentication import AuthenticatedAction, AuthTestCase
+from tests.data_tests import COURSE, MEMBER, SEASON
 
 
 @pytest.mark.django_db
@@ -630,6 +637,213 @@ class TestMemberApiView(AuthTestCase):
             assert response.status_code == 204, response
         assert Member.objects.count() == 0
 
+    @parameterized.expand([("asc", [0, 1, 2]), ("desc", [2, 1, 0])])
+    def test_get_sort_solde(self, order, expected):
+        self._kwargs = {}
+        members = [self._member]
+        self._member.active_courses.add(self._course)
+        for i in range(1, 3):
+            user = User.objects.create(username=f"user{i}", email=f"user{i}@kdance.com")
+            Payment.objects.create(user=user, season=self._season)
+            member = Member.objects.create(
+                **{**MEMBER, "first_name": f"Plip{i}"},
+                user=user,
+                season=self._season,
+            )
+            member.active_courses.add(self._course)
+            members.append(member)
+        # Balances: 20 - 15, 20 - 0 + 0, 20 - 0 + 10
+        Payment.objects.filter(user=self.testuser).update(cash=15)
+        Payment.objects.filter(user__username="user2").update(refund=10)
+        expected_ids = [members[i].pk for i in expected]
+        with AuthenticatedAction(self.client, self.super_testuser):
+            for offset in range(3):
+                response = self.client.get(
+                    self.view_url,
+                    {
+                        "season": self._season.pk,
+                        "sort": "solde",
+                        "order": order,
+                        "without_details": "true",
+                        "limit": 1,
+                        "offset": offset,
+                    },
+                )
+                assert response.status_code == 200, response
+                response_json = response.json()
+                assert response_json["count"] == 3
+                assert [m["id"] for m in response_json["results"]] == [
+                    expected_ids[offset]
+                ]
+
+    @parameterized.expand(
+        [
+            ("helene", True),
+            ("HÉL", True),
+            ("dup", True),
+            ("dupont hel", True),
+            ("hélène  dupont", True),
+            ("lene", False),
+            ("pont", False),
+        ]
+    )
+    def test_get_search(self, search, found):
+        self._kwargs = {}
+        member = Member.objects.create(
+            **{**MEMBER, "first_name": "hélène", "last_name": "Dupont"},
+            user=self.testuser,
+            season=self._season,
+        )
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(
+                self.view_url, {"search": search, "without_details": "true"}
+            )
+            assert response.status_code == 200, response
+            ids = [m["id"] for m in response.json()["results"]]
+        assert ids == ([member.pk] if found else [])
+
+    @parameterized.expand(
+        [
+            ({"fields": "id,first_name"}, {"id", "first_name"}, None),
+            ({"fields": "id, payment.due"}, {"id", "payment"}, {"due"}),
+            ({"exclude": "payment,contacts"}, None, None),
+        ]
+    )
+    def test_get_fields(self, params, keys, payment_keys):
+        self._kwargs = {}
+        self._member.active_courses.add(self._course)
+        with AuthenticatedAction(self.client, self.super_testuser):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.view_url, params)
+            assert response.status_code == 200, response
+            (member,) = response.json()
+        if keys is not None:
+            assert set(member) == keys
+        if payment_keys is None:
+            assert "payment" not in member
+            # Unrequested fields are not even loaded
+            assert not any(
+                "members_payment" in query["sql"] for query in context.captured_queries
+            )
+        else:
+            assert set(member["payment"]) == payment_keys
+        if "active_courses" in member:
+            assert member["active_courses"][0]["name"] == self._course.name
+
+    @parameterized.expand([(False,), (True,)])
+    def test_get_normalized(self, without_details):
+        self._kwargs = {}
+        self._course.teacher = Teacher.objects.create(name="Prof")
+        self._course.save()
+        for i in range(3):
+            user = User.objects.create(username=f"user{i}")
+            Payment.objects.create(user=user, season=self._season)
+            Member.objects.create(
+                **{**MEMBER, "first_name": f"Plip{i}"}, user=user, season=self._season
+            ).active_courses.add(self._course)
+        params = {"season": self._season.pk}
+        if without_details:
+            params["without_details"] = "true"
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(self.view_url, params)
+            nested_size = len(response.content)
+            response = self.client.get(
+                self.view_url, {**params, "format": "normalized"}
+            )
+            assert response.status_code == 200, response
+        assert len(response.content) < nested_size
+        response_json = response.json()
+        assert len(response_json["results"]) == 4
+        for member in response_json["results"][1:]:
+            assert member["active_courses"] == [self._course.pk]
+        course_pk, season_pk = str(self._course.pk), str(self._season.pk)
+        teacher_pk = str(self._course.teacher_id)
+        assert list(response_json["included"]["courses"]) == [course_pk]
+        assert (
+            response_json["included"]["courses"][course_pk]["name"] == self._course.name
+        )
+        assert response_json["included"]["courses"][course_pk]["season"] == (
+            self._season.pk
+        )
+        assert list(response_json["included"]["seasons"]) == [season_pk]
+        assert response_json["included"]["seasons"][season_pk]["year"] == "1900-1901"
+        assert list(response_json["included"]["teachers"]) == [teacher_pk]
+        if without_details:
+            assert response_json["count"] == 4
+        else:
+            assert response_json["results"][0]["season"] == self._season.pk
+            assert response_json["results"][0]["payment"]["season"] == self._season.pk
+
+    def _walk_cursor(self, url: str, direction: str) -> tuple[list[int], set[int]]:
+        ids: list[int] = []
+        queries = set()
+        with AuthenticatedAction(self.client, self.super_testuser):
+            while url:
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                assert response.status_code == 200, response
+                response_json = response.json()
+                assert "count" not in response_json
+                assert len(response_json["results"]) <= 2
+                queries.add(len(context.captured_queries))
+                page_ids = [m["id"] for m in response_json["results"]]
+                ids = ids + page_ids if direction == "next" else page_ids + ids
+                url = response_json[direction]
+                if direction == "next" and url:
+                    self._last_cursor_url = url
+        return ids, queries
+
+    def test_get_cursor(self):
+        self._kwargs = {}
+        season = Season.objects.create(**SEASON, year="1901-1902")
+        self._member.active_courses.add(self._course)
+        for i, (first_name, last_name) in enumerate(
+            [
+                ("Bob", "Alpha"),
+                ("Zoe", "Plop"),
+                ("Bob", "Alpha"),
+                ("Alice", "Alpha"),
+                ("Plip", "Plop"),
+            ]
+        ):
+            user = User.objects.create(username=f"cursor{i}")
+            member_season = season if i % 2 else self._season
+            Payment.objects.get_or_create(user=user, season=member_season)
+            Member.objects.create(
+                **{**MEMBER, "first_name": first_name, "last_name": last_name},
+                user=user,
+                season=member_season,
+            ).active_courses.add(self._course)
+        expected = list(
+            Member.objects.order_by(
+                "-season__year", "last_name", "first_name", "id"
+            ).values_list("pk", flat=True)
+        )
+        ids, queries = self._walk_cursor(f"{self.view_url}?cursor=&limit=2", "next")
+        assert ids == expected
+        # Pages cost the same whatever their position
+        assert len(queries) == 1
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(self._last_cursor_url)
+        ids, _ = self._walk_cursor(response.json()["previous"], "previous")
+        assert ids == expected[:4]
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(
+                self.view_url,
+                {"cursor": "", "with_count": "true", "season": season.pk},
+            )
+            assert response.status_code == 200, response
+            assert response.json()["count"] == 2
+            assert response.json()["next"] is None
+            assert response.json()["previous"] is None
+            response = self.client.get(self.view_url, {"cursor": "nope"})
+            assert response.status_code == 404, response
+            response = self.client.get(self.view_url, {"cursor": "", "sort": "name"})
+            assert response.status_code == 400, response
+            assert response.json() == {
+                "sort": ["Le tri n'est pas disponible avec un curseur."]
+            }
+
 
 @pytest.mark.django_db
 class TestMembersCoursesApiView(AuthTestCase):
@@ -711,6 +925,28 @@ class TestMembersCoursesApiView(AuthTestCase):
         assert not len(self._member.active_courses.all())
         assert self._course in self._member.cancelled_courses.all()
 
+    def test_remove_digest(self):
+        other_course, _ = Course.objects.get_or_create(
+            **{**COURSE, "name": "Rumba"}, season=self._season
+        )
+        self._member.active_courses.add(self._course, other_course)
+        self._kwargs["action"] = "remove"
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.put(
+                self.view_url,
+                data={
+                    "courses": [self._course.pk, other_course.pk],
+                    "cancel_refund": 0,
+                },
+                content_type="application/json",
+            )
+            assert response.status_code == 200, response
+        (digest,) = mail.outbox
+        assert digest.subject == "2 notifications K'Dance"
+        assert f"au cours {self._course.name} a bien" in digest.body
+        assert "au cours Rumba a bien" in digest.body
+        assert digest.alternatives[0][0].count("<hr />") == 1
+
     @parameterized.expand(
         [
             (1000000, None, "add", "courses", 400, "l'objet n'existe pas."),
@@ -6,15 +6,26 @@ from urllib.parse import urlencode
 import pytest
 
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 from django.utils import timezone
 from parameterized import parameterized
 
 from members.api.views import CheckViewSet, PaymentViewSet
-from members.models import Check, Payment, Season
+from members.models import (
+    Ancv,
+    Check,
+    Course,
+    Member,
+    Payment,
+    PaymentBalance,
+    Season,
+)
 from tests.authentication import AuthenticatedAction, AuthTestCase
-from tests.data_tests import SEASON
+from tests.data_tests import COURSE, MEMBER, SEASON
 
 
 @pytest.mark.django_db
@@ -196,6 +207,62 @@ class TestPaymentApiView(AuthTestCase):
             assert response_json[-1]["season"]["id"] == self._season.pk
             assert response_json[-1]["comment"] == self.testuser.username
 
+    def _list_queries(self, users_count: int) -> int:
+        for i in range(users_count):
+            user = User.objects.create(
+                username=f"user{users_count}-{i}",
+                email=f"user{users_count}-{i}@kdance.com",
+            )
+            payment = Payment.objects.create(user=user, season=self._season)
+            member = Member.objects.create(
+                **{**MEMBER, "first_name": f"Plip{i}"},
+                user=user,
+                season=self._season,
+            )
+            member.active_courses.add(self._course)
+            Ancv.objects.create(amount=10, count=1, payment=payment)
+            Check.objects.create(
+                number=i, name="Bob", bank="bank", amount=20, month=1, payment=payment
+            )
+        with AuthenticatedAction(self.client, self.super_testuser):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.view_url, {"season": self._season.pk})
+            assert response.status_code == 200, response
+            assert len(response.json()) == users_count
+            assert response.json()[0]["paid"] == 30
+            assert response.json()[0]["due"] == 20
+        return len(context.captured_queries)
+
+    def test_get_fields(self):
+        self._kwargs = {}
+        with AuthenticatedAction(self.client, self.super_testuser):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    self.view_url,
+                    {"fields": "id,cash,season.year", "exclude": "cash"},
+                )
+            assert response.status_code == 200, response
+        assert [set(payment) for payment in response.json()] == [{"id", "season"}] * 2
+        assert set(response.json()[0]["season"]) == {"year"}
+        assert not any(
+            table in query["sql"]
+            for query in context.captured_queries
+            for table in ("members_check", "members_paymentbalance", "members_ancv")
+        )
+
+    def test_get_list_queries(self):
+        self._kwargs = {}
+        self._course = Course.objects.create(**COURSE, season=self._season)
+        queries = self._list_queries(1)
+        Member.objects.all().delete()
+        assert self._list_queries(5) == queries
+        # Missing balances are computed all at once
+        PaymentBalance.objects.all().delete()
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(self.view_url, {"season": self._season.pk})
+            assert [p["due"] - p["paid"] for p in response.json()] == [-10] * 5
+        assert PaymentBalance.objects.count() == 5
+
     @parameterized.expand(
         [
             ("ancv", {"amount": 10, "count": 2}, 10, 0),
@@ -238,6 +305,45 @@ class TestPaymentApiView(AuthTestCase):
         assert self.testuser.payment_set.first().paid == paid
         assert self.testuser.payment_set.first().due == due
 
+    def _patch_checks(self, checks: list[dict]) -> int:
+        with AuthenticatedAction(self.client, self.super_testuser):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(
+                    self.view_url,
+                    data={"check_payment": checks},
+                    content_type="application/json",
+                )
+            assert response.status_code == 200, response
+        return len(context.captured_queries)
+
+    def test_patch_checks_diff(self):
+        payment = self.testuser.payment_set.first()
+        self._kwargs = {"pk": payment.pk}
+        checks = [
+            {"amount": 10.0, "bank": "bank", "month": 1, "name": "Bob", "number": i}
+            for i in range(12)
+        ]
+        self._patch_checks(checks[:10])
+        ids = dict(Check.objects.filter(payment=payment).values_list("number", "pk"))
+        assert len(ids) == 10
+        checks[0]["amount"] = 20.0
+        queries = self._patch_checks(checks[:8] + [checks[10]])
+        new_ids = dict(
+            Check.objects.filter(payment=payment).values_list("number", "pk")
+        )
+        assert {i: new_ids[i] for i in range(8)} == {i: ids[i] for i in range(8)}
+        assert set(new_ids) == {*range(8), 10}
+        assert Check.objects.get(pk=ids[0]).amount == 20
+        payment.refresh_from_db()
+        assert payment.ledger.paid == 100
+        # Same statements whatever the number of checks
+        checks[1]["amount"] = 30.0
+        assert self._patch_checks([checks[1], checks[11]]) == queries
+        assert Check.objects.filter(payment=payment).count() == 2
+        # Sending no check removes them all
+        self._patch_checks([])
+        assert not Check.objects.filter(payment=payment).exists()
+
     @parameterized.expand(
         [
             (
@@ -6,14 +6,25 @@ from urllib.parse import urlencode
 import pytest
 
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from parameterized import parameterized
 
 from members.api.views import SeasonViewSet
-from members.models import Season
+from members.models import (
+    Ancv,
+    CBPayment,
+    Check,
+    Course,
+    Member,
+    Payment,
+    PaymentBalance,
+    Season,
+)
 from tests.authentication import AuthenticatedAction, AuthTestCase
-from tests.data_tests import SEASON
+from tests.data_tests import COURSE, MEMBER, SEASON
 
 
 @pytest.mark.django_db
@@ -274,3 +285,58 @@ class TestSeasonApiView(AuthTestCase):
             response = self.client.delete(self.view_url)
             assert response.status_code == 204, response
         assert Season.objects.count() == 0
+
+    def test_summary(self):
+        course = Course.objects.create(**COURSE, season=self._season)
+        member = Member.objects.create(
+            **MEMBER, user=self.testuser, season=self._season
+        )
+        member.active_courses.add(course)
+        payment = Payment.objects.get(user=self.testuser, season=self._season)
+        payment.cash = 5
+        payment.save()
+        for month in (1, 1, 2):
+            Check.objects.create(
+                number=month,
+                name="Bob",
+                bank="b",
+                amount=3,
+                month=month,
+                payment=payment,
+            )
+        Ancv.objects.create(amount=4, count=1, payment=payment)
+        CBPayment.objects.create(amount=2, transaction_type="CAWL", payment=payment)
+        # Balances not computed yet are included
+        PaymentBalance.objects.all().delete()
+        url = reverse("api-seasons-summary", kwargs={"pk": self._season.pk})
+        with AuthenticatedAction(self.client, self.testuser):
+            assert self.client.get(url).status_code == 403
+        with AuthenticatedAction(self.client, self.super_testuser):
+            response = self.client.get(url)
+            assert response.status_code == 200, response
+            summary = response.json()
+            assert summary["due"] == 20
+            assert summary["paid"]["total"] == 20
+            assert summary["paid"]["cash"] == 5
+            assert summary["paid"]["checks"]["amount"] == 9
+            assert summary["paid"]["checks"]["by_month"] == [
+                {"month": 1, "amount": 6, "count": 2},
+                {"month": 2, "amount": 3, "count": 1},
+            ]
+            assert summary["paid"]["cb"]["by_type"] == [
+                {"transaction_type": "CAWL", "amount": 2, "count": 1}
+            ]
+            assert summary["paid"]["ancv"] == {"amount": 4, "count": 1}
+            assert summary["balance"] == 0
+            # Cached until balances change
+            with CaptureQueriesContext(connection) as context:
+                assert self.client.get(url).json() == summary
+            cached_queries = len(context.captured_queries)
+            Check.objects.create(
+                number=3, name="Bob", bank="b", amount=3, month=3, payment=payment
+            )
+            with CaptureQueriesContext(connection) as context:
+                summary = self.client.get(url).json()
+            assert len(context.captured_queries) > cached_queries
+            assert summary["paid"]["total"] == 23
+            assert summary["balance"] == -3
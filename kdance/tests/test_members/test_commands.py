@@ -0,0 +1,228 @@
+"""Tests related to management commands."""
+
+from io import StringIO
+from smtplib import SMTPException
+from unittest.mock import patch
+
+import pytest
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from members.archives import read_records
+from members.models import (
+    Announcement,
+    AnnouncementRecipient,
+    Check,
+    Course,
+    Documents,
+    EmailOutbox,
+    Member,
+    OtherPayment,
+    Payment,
+    PaymentBalance,
+    Season,
+    SportPass,
+    WaitingList,
+)
+from tests.data_tests import COURSE, MEMBER, SEASON, TESTUSER, TESTUSER_EMAIL
+
+
+@pytest.mark.django_db
+class TestPaymentBalancesCommand:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.user = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+        self.season = Season.objects.create(**SEASON, year="1900-1901")
+        member = Member.objects.create(**MEMBER, user=self.user, season=self.season)
+        member.active_courses.add(Course.objects.create(**COURSE, season=self.season))
+        self.payment = Payment.objects.get(user=self.user, season=self.season)
+
+    def test_verify(self):
+        out = StringIO()
+        call_command("payment_balances", "1900-1901", "--verify", stdout=out)
+        assert "Soldes cohérents" in out.getvalue()
+
+    def test_verify_drift(self):
+        PaymentBalance.objects.filter(payment=self.payment).update(due=0)
+        out = StringIO()
+        with pytest.raises(CommandError, match="1 solde"):
+            call_command("payment_balances", "--verify", stdout=out)
+        assert TESTUSER in out.getvalue()
+        assert PaymentBalance.objects.get(payment=self.payment).due == 0
+
+    def test_rebuild(self):
+        PaymentBalance.objects.filter(payment=self.payment).delete()
+        Payment.objects.filter(pk=self.payment.pk).update(cash=5)
+        out = StringIO()
+        call_command("payment_balances", stdout=out)
+        assert "1 solde(s) recalculé(s)" in out.getvalue()
+        ledger = PaymentBalance.objects.get(payment=self.payment)
+        assert (ledger.due, ledger.paid, ledger.balance) == (20, 5, 15)
+
+    def test_unknown_season(self):
+        with pytest.raises(CommandError, match="Saison introuvable"):
+            call_command("payment_balances", "1800-1801")
+
+
+@pytest.mark.django_db
+class TestPurgeSeasonsCommand:
+    @pytest.fixture(autouse=True)
+    def setup(self, settings, tmp_path):
+        settings.SEASON_ARCHIVE_DIR = tmp_path
+        self.user = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+        self.old = Season.objects.create(**SEASON, year="1900-1901")
+        course = Course.objects.create(**COURSE, season=self.old)
+        for i in range(3):
+            member = Member.objects.create(
+                **{**MEMBER, "first_name": f"Plip{i}"},
+                user=self.user,
+                season=self.old,
+                documents=Documents.objects.create(
+                    authorise_photos=True, authorise_emergency=True
+                ),
+                sport_pass=SportPass.objects.create(code=str(i)),
+            )
+            member.active_courses.add(course)
+            member.waiting_courses.add(course)
+            WaitingList.objects.create(course=course, member=member)
+        payment = Payment.objects.get(user=self.user, season=self.old)
+        Check.objects.create(
+            number=1, name="Bob", bank="bank", amount=10, month=1, payment=payment
+        )
+        payment.other_payment = OtherPayment.objects.create(amount=5, comment="Bon")
+        payment.save()
+        announcement = Announcement.objects.create(
+            season=self.old, course=course, subject="Gala", message="Plop"
+        )
+        announcement.add_recipients()
+        for i in range(1, Season.SEASON_COUNT + 1):
+            Season.objects.create(**SEASON, year=f"190{i}-190{i + 1}")
+        self.kept = Season.objects.get(year="1901-1902")
+        Member.objects.create(**MEMBER, user=self.user, season=self.kept)
+
+    def test_expired_season_hidden(self):
+        assert Season.objects.count() == Season.SEASON_COUNT
+        assert not Season.objects.filter(pk=self.old.pk).exists()
+        assert Season._base_manager.get(pk=self.old.pk).purge_pending
+
+    # Committed batches: foreign keys are checked at each step
+    @pytest.mark.django_db(transaction=True)
+    def test_purge(self):
+        out = StringIO()
+        with patch.object(Course.objects, "schedule_queue_update") as schedule:
+            call_command("purge_seasons", "--batch-size", "2", stdout=out)
+        schedule.assert_not_called()
+        assert "3 adhérent(s) supprimé(s)" in out.getvalue()
+        members = list(read_records(self.old.year, ["member"]))
+        assert len(members) == 3
+        assert {member["data"]["documents_id"] for member in members} != {None}
+        assert not Season._base_manager.filter(pk=self.old.pk).exists()
+        assert Member._base_manager.filter(season=self.kept).count() == 1
+        assert not Course.objects.exists()
+        assert not WaitingList.objects.exists()
+        assert not Documents.objects.exists()
+        assert not SportPass.objects.exists()
+        assert not Check.objects.exists()
+        assert not Member.active_courses.through.objects.exists()
+        assert Payment.objects.count() == Season.SEASON_COUNT
+        assert not Announcement.objects.exists()
+        assert not OtherPayment.objects.exists()
+        assert len(list(read_records(self.old.year, ["other_payment"]))) == 1
+        assert not AnnouncementRecipient.objects.exists()
+        assert not PaymentBalance.objects.filter(payment__season=self.old).exists()
+
+    def test_purge_resume(self):
+        def interrupt(message):
+            if "adhérent" in message:
+                raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            Season.objects.purge(batch_size=1, progress=interrupt)
+        assert not Member._base_manager.filter(season=self.old).exists()
+        assert Season._base_manager.filter(pk=self.old.pk).exists()
+        out = StringIO()
+        call_command("purge_seasons", stdout=out)
+        assert "0 adhérent(s) supprimé(s)" in out.getvalue()
+        assert "1 paiement(s) supprimé(s)" in out.getvalue()
+        assert not Season._base_manager.filter(pk=self.old.pk).exists()
+
+
+@pytest.mark.django_db
+def test_send_outbox():
+    EmailOutbox.objects.bulk_create(
+        EmailOutbox(to=[TESTUSER_EMAIL], subject=f"Plop {i}", body="Plip")
+        for i in range(3)
+    )
+    out = StringIO()
+    call_command("send_outbox", "--once", "--batch-size", "2", stdout=out)
+    assert "2 email(s) envoyé(s), 0 échec(s)." in out.getvalue()
+    assert "1 email(s) envoyé(s), 0 échec(s)." in out.getvalue()
+    assert len(mail.outbox) == 3
+    assert not EmailOutbox.objects.exclude(status=EmailOutbox.StatusEnum.SENT).exists()
+
+
+def test_benchmark_emails():
+    out = StringIO()
+    call_command("benchmark_emails", "--number", "2", stdout=out)
+    assert "create_user: " in out.getvalue()
+    assert len(mail.outbox) == 0
+
+
+@pytest.mark.django_db
+@patch("members.management.commands.send_announcements.time.sleep")
+def test_send_announcements(mock_sleep):
+    testuser = User.objects.create(username=TESTUSER_EMAIL, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    for i in range(3):
+        Member.objects.create(
+            **{**MEMBER, "first_name": f"Plip{i}", "email": f"plip{i}@plop.fr"},
+            user=testuser,
+            season=season,
+        )
+    announcement, other = (
+        Announcement.objects.create(season=season, subject=subject, message=message)
+        for subject, message in (("Gala", "<b>21 juin</b>"), ("Stage", "Plop"))
+    )
+    assert announcement.add_recipients() == 4
+    assert other.add_recipients() == 4
+    with patch.object(
+        locmem.EmailBackend,
+        "send_messages",
+        autospec=True,
+        side_effect=[1, SMTPException("Refusé")] + [1] * 6,
+    ):
+        out = StringIO()
+        call_command(
+            "send_announcements",
+            "--once",
+            "--batch-size",
+            "3",
+            "--per-minute",
+            "60",
+            stdout=out,
+        )
+    assert "Gala: 2 email(s) envoyé(s), 1 échec(s), En cours." in out.getvalue()
+    assert "Gala: 1 email(s) envoyé(s), 0 échec(s), Terminé." in out.getvalue()
+    assert "Stage: 1 email(s) envoyé(s), 0 échec(s), Terminé." in out.getvalue()
+    # One second per email, whatever the announcement
+    waits = [call.args[0] for call in mock_sleep.call_args_list]
+    assert waits == [3, 1, 3, 1]
+    failed = announcement.recipients.get(status=AnnouncementRecipient.StatusEnum.FAILED)
+    assert failed.error == "Refusé"
+    announcement.resume()
+    assert announcement.send_batch() == (1, 0)
+    assert announcement.status == Announcement.StatusEnum.DONE
+    (resent,) = mail.outbox
+    assert resent.to == [failed.email]
+    assert resent.subject == "Gala"
+    assert "<b>21 juin</b>" in resent.body
+    assert "&lt;b&gt;21 juin&lt;/b&gt;" in resent.alternatives[0][0]
+
+
+def test_send_announcements_budget():
+    with pytest.raises(CommandError):
+        call_command("send_announcements", "--per-minute", "0")
@@ -5,10 +5,19 @@ from unittest.mock import patch
 import pytest
 
 from django.conf import settings
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.db import transaction
+from django.template.loader import get_template
 from django.utils import timezone
 
-from members.emails import EmailEnum, EmailSender
-from members.models import Course, Season
+from members.emails import (
+    EMAIL_TEMPLATES,
+    EmailEnum,
+    EmailSender,
+    coalesced_emails,
+)
+from members.models import Course, EmailOutbox, Season
 from django.core.mail import EmailMultiAlternatives
 from tests.data_tests import COURSE as TEST_COURSE
 
@@ -44,17 +53,17 @@ class TestEmailSender:
                 self.email_sender.send_email([], **partial_kwargs)
 
     def test_build_subject(self):
-        subject = self.email_sender.get_subject()(**self.expected_kwargs)
+        subject = self.email_sender.build_subject(**self.expected_kwargs)
         assert subject == self.expected_subject
 
     @pytest.mark.django_db
     def test_build_text(self):
-        text = self.email_sender.get_build_text()(**self.expected_kwargs)
+        text = self.email_sender.build_text(**self.expected_kwargs)
         assert text == self.expected_text
 
     @pytest.mark.django_db
     def test_build_html(self):
-        html = self.email_sender.get_build_html()(**self.expected_kwargs)
+        html = self.email_sender.build_html(**self.expected_kwargs)
         assert html == self.expected_html
 
     @pytest.mark.django_db
@@ -177,7 +186,7 @@ Tech K'Dance
     @pytest.mark.django_db
     def test_build_text_with_active(self):
         active_courses = [self.set_course()]
-        text = self.email_sender.get_build_text()(
+        text = self.email_sender.build_text(
             **self.expected_kwargs,
             active_courses=active_courses,
         )
@@ -201,7 +210,7 @@ Tech K'Dance
     @pytest.mark.django_db
     def test_build_html_with_active(self):
         active_courses = [self.set_course()]
-        html = self.email_sender.get_build_html()(
+        html = self.email_sender.build_html(
             **self.expected_kwargs,
             active_courses=active_courses,
         )
@@ -228,7 +237,7 @@ Tech K'Dance
     @pytest.mark.django_db
     def test_build_text_with_waiting(self):
         waiting_courses = [self.set_course()]
-        text = self.email_sender.get_build_text()(
+        text = self.email_sender.build_text(
             **self.expected_kwargs,
             waiting_courses=waiting_courses,
         )
@@ -253,7 +262,7 @@ Tech K'Dance
     @pytest.mark.django_db
     def test_build_html_with_waiting(self):
         waiting_courses = [self.set_course()]
-        html = self.email_sender.get_build_html()(
+        html = self.email_sender.build_html(
             **self.expected_kwargs,
             waiting_courses=waiting_courses,
         )
@@ -283,7 +292,7 @@ Tech K'Dance
         course = self.set_course()
         active_courses = [course, course]
         waiting_courses = [course, course]
-        text = self.email_sender.get_build_text()(
+        text = self.email_sender.build_text(
             **self.expected_kwargs,
             active_courses=active_courses,
             waiting_courses=waiting_courses,
@@ -317,7 +326,7 @@ Tech K'Dance
         course = self.set_course()
         active_courses = [course, course]
         waiting_courses = [course, course]
-        html = self.email_sender.get_build_html()(
+        html = self.email_sender.build_html(
             **self.expected_kwargs,
             active_courses=active_courses,
             waiting_courses=waiting_courses,
@@ -517,7 +526,7 @@ Tech K'Dance
     @pytest.mark.django_db
     def test_build_text_with_warning(self):
         self.expected_kwargs["with_next_course_warning"] = True
-        text = self.email_sender.get_build_text()(
+        text = self.email_sender.build_text(
             **self.expected_kwargs,
         )
         assert (
@@ -537,7 +546,7 @@ Tech K'Dance
     @pytest.mark.django_db
     def test_build_html_with_warning(self):
         self.expected_kwargs["with_next_course_warning"] = True
-        html = self.email_sender.get_build_html()(
+        html = self.email_sender.build_html(
             **self.expected_kwargs,
         )
         assert (
@@ -652,3 +661,155 @@ Tech K'Dance
   Tech K'Dance
 </p>
 """
+
+
+def test_templates_registered():
+    for email_type in EmailEnum:
+        template = EMAIL_TEMPLATES[email_type]
+        for extension in ("txt", "html"):
+            assert get_template(f"emails/{template.template}.{extension}")
+
+
+def test_html_escaped():
+    sender = EmailSender(EmailEnum.CREATE_USER)
+    assert "<b>" in sender.build_text(username="<b>")
+    assert "&lt;b&gt;" in sender.build_html(username="<b>")
+
+
+@pytest.mark.django_db
+def test_send_emails_one_connection():
+    sender = EmailSender(EmailEnum.CREATE_USER)
+    with patch(
+        "members.emails.get_connection", wraps=mail.get_connection
+    ) as get_connection:
+        sender.send_emails(
+            ([f"{i}{USERNAME}"], {"username": f"{i}{USERNAME}"}) for i in range(10)
+        )
+    get_connection.assert_called_once()
+    assert [sent.to for sent in mail.outbox] == [[f"{i}{USERNAME}"] for i in range(10)]
+    assert f"(0{USERNAME})" in mail.outbox[0].body
+
+
+@pytest.mark.django_db
+class TestEmailOutbox:
+    @pytest.fixture(autouse=True)
+    def use_outbox(self, settings):
+        settings.EMAIL_OUTBOX = True
+
+    def test_enqueue_on_commit(self, django_capture_on_commit_callbacks):
+        sender = EmailSender(EmailEnum.CREATE_USER)
+        with django_capture_on_commit_callbacks(execute=True):
+            sender.send_email([USERNAME], username=USERNAME)
+            assert not EmailOutbox.objects.exists()
+        assert not mail.outbox
+        email = EmailOutbox.objects.get()
+        assert email.to == [USERNAME]
+        assert email.subject == "Création d'un compte K'Dance"
+        assert email.status == EmailOutbox.StatusEnum.PENDING
+        assert f"({USERNAME})" in email.html
+
+    def test_rollback_drops_email(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=False) as callbacks:
+            EmailSender(EmailEnum.CREATE_USER).send_email([USERNAME], username=USERNAME)
+        assert len(callbacks) == 1
+        assert not EmailOutbox.objects.exists()
+
+    def test_send_pending(self):
+        EmailOutbox.objects.create(to=[USERNAME], subject="Plop", body="Plip")
+        assert EmailOutbox.objects.send_pending(10, 3) == (1, 0)
+        email = EmailOutbox.objects.get()
+        assert email.status == EmailOutbox.StatusEnum.SENT
+        assert email.attempts == 1
+        assert email.sent is not None
+        (sent,) = mail.outbox
+        assert (sent.to, sent.subject, sent.body) == ([USERNAME], "Plop", "Plip")
+        assert EmailOutbox.objects.send_pending(10, 3) == (0, 0)
+
+    @patch.object(
+        locmem.EmailBackend, "send_messages", side_effect=OSError("SMTP down")
+    )
+    def test_send_pending_retry(self, _mock_send):
+        EmailOutbox.objects.create(to=[USERNAME], subject="Plop", body="Plip")
+        assert EmailOutbox.objects.send_pending(10, 2) == (0, 1)
+        email = EmailOutbox.objects.get()
+        assert email.status == EmailOutbox.StatusEnum.PENDING
+        assert email.last_error == "SMTP down"
+        assert email.next_attempt > timezone.now()
+        # Not due yet
+        assert EmailOutbox.objects.send_pending(10, 2) == (0, 0)
+        EmailOutbox.objects.update(next_attempt=timezone.now())
+        assert EmailOutbox.objects.send_pending(10, 2) == (0, 1)
+        email.refresh_from_db()
+        assert (email.status, email.attempts) == (EmailOutbox.StatusEnum.FAILED, 2)
+
+    def test_send_pending_claimed(self):
+        EmailOutbox.objects.create(to=[USERNAME], subject="Plop", body="Plip")
+
+        def send_messages(backend, messages):
+            # Sent once claimed, out of the claiming transaction
+            assert EmailOutbox.objects.get().next_attempt > timezone.now()
+            return len(messages)
+
+        with patch.object(
+            locmem.EmailBackend,
+            "send_messages",
+            autospec=True,
+            side_effect=send_messages,
+        ):
+            assert EmailOutbox.objects.send_pending(10, 3) == (1, 0)
+        assert EmailOutbox.objects.get().status == EmailOutbox.StatusEnum.SENT
+
+    @patch.object(locmem.EmailBackend, "open", side_effect=OSError("Injoignable"))
+    def test_send_pending_unreachable(self, _mock_open):
+        for subject in ("Plop", "Plip"):
+            EmailOutbox.objects.create(to=[USERNAME], subject=subject, body="Plip")
+        assert EmailOutbox.objects.send_pending(10, 2) == (0, 0)
+        # Released at once, without counting an attempt
+        for email in EmailOutbox.objects.all():
+            assert (email.status, email.attempts) == (EmailOutbox.StatusEnum.PENDING, 0)
+            assert email.next_attempt <= timezone.now()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_coalesced_emails():
+    with coalesced_emails():
+        with coalesced_emails():
+            EmailSender(EmailEnum.CREATE_USER).send_email([USERNAME], username=USERNAME)
+        EmailSender(EmailEnum.DELETE_USER).send_emails(
+            [([USERNAME], {"username": USERNAME}), ([URL], {"username": URL})]
+        )
+        assert not mail.outbox
+    digest, single = mail.outbox
+    assert digest.to == [USERNAME]
+    assert digest.subject == "2 notifications K'Dance"
+    assert "Vous venez de créer votre compte" in digest.body
+    assert "a bien été supprimé" in digest.body
+    assert single.to == [URL]
+    assert single.subject == "Suppression de votre compte K'Dance"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_coalesced_emails_rollback():
+    with coalesced_emails():
+        EmailSender(EmailEnum.CREATE_USER).send_email([USERNAME], username=USERNAME)
+        with pytest.raises(ValueError), transaction.atomic():
+            EmailSender(EmailEnum.DELETE_USER).send_email([URL], username=URL)
+            raise ValueError
+        with transaction.atomic():
+            EmailSender(EmailEnum.DELETE_USER).send_email([USERNAME], username=USERNAME)
+    (digest,) = mail.outbox
+    assert digest.to == [USERNAME]
+    assert digest.subject == "2 notifications K'Dance"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_coalesced_emails_error():
+    with pytest.raises(ValueError), coalesced_emails():
+        EmailSender(EmailEnum.CREATE_USER).send_email([USERNAME], username=USERNAME)
+        raise ValueError
+    assert not mail.outbox
+    # The next block starts afresh
+    with coalesced_emails():
+        EmailSender(EmailEnum.DELETE_USER).send_email([URL], username=URL)
+    (single,) = mail.outbox
+    assert single.to == [URL]
@@ -1,20 +1,40 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from unittest.mock import patch
 
 import pytest
 
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
+from django.core import mail
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from parameterized import parameterized
+from members.caching import request_scope
 from members.models import (
+    Ancv,
+    CBPayment,
+    Check,
+    Contact,
     Course,
     GeneralSettings,
+    Member,
+    OtherPayment,
     Payment,
+    PaymentBalance,
     Season,
+    SportCoupon,
+    SportPass,
+    WaitingList,
+    members_validated,
 )
 from tests.data_tests import (
     COURSE,
+    MEMBER,
     SEASON,
     TESTUSER,
     TESTUSER_EMAIL,
@@ -81,6 +101,51 @@ def test_season_create_payment():
     assert Payment.objects.first().user == testuser
 
 
+@pytest.mark.django_db
+def test_season_create_payment_bulk():
+    User.objects.bulk_create(
+        User(username=f"user{i}", email=f"user{i}@test.com") for i in range(30)
+    )
+    with CaptureQueriesContext(connection) as queries:
+        season = Season.objects.create(
+            year="1900-1901",
+            pre_signup_start=timezone.now() - timedelta(days=2),
+            pre_signup_end=timezone.now() + timedelta(days=2),
+            ffd_a_amount=0,
+            ffd_b_amount=0,
+            ffd_c_amount=0,
+            ffd_d_amount=0,
+        )
+    inserts = [
+        q for q in queries if q["sql"].startswith('INSERT INTO "members_payment"')
+    ]
+    assert len(inserts) == 1
+    assert Payment.objects.filter(season=season).count() == 30
+    assert not PaymentBalance.objects.exists()
+    payment = Payment.objects.filter(season=season).first()
+    assert payment.ledger.due == 0
+    assert PaymentBalance.objects.count() == 1
+    assert not PaymentBalance.objects.drifted(Payment.objects.filter(season=season))
+    # Refreshing upserts the existing row
+    balance_id = payment.ledger.pk
+    PaymentBalance.objects.refresh(Payment.objects.filter(season=season))
+    assert PaymentBalance.objects.count() == 30
+    assert PaymentBalance.objects.get(payment=payment).pk == balance_id
+
+
+@pytest.mark.django_db
+def test_season_save_refreshes_balances():
+    User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    with patch.object(PaymentBalance.objects, "refresh") as refresh:
+        season.signup_end = timezone.now() + timedelta(days=30)
+        season.save()
+        assert not refresh.called
+        season.discount_percent += 5
+        season.save()
+        assert refresh.called
+
+
 @parameterized.expand([True, False])
 @patch.object(Course, "update_queue")
 @pytest.mark.django_db
@@ -95,3 +160,403 @@ def test_manage_waiting_list(can_add_member, update):
     gen_settings.save()
     Course.objects.manage_waiting_lists()
     assert update.called is can_add_member
+
+
+def _promote(course: Course, capacity: int, captured_queries: list) -> None:
+    course.capacity = capacity
+    with CaptureQueriesContext(connection) as context:
+        course.update_queue()
+    captured_queries.append(len(context.captured_queries))
+
+
+@pytest.mark.django_db
+def test_update_queue(django_capture_on_commit_callbacks):
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    course = Course.objects.create(**COURSE, season=season, capacity=1)
+    members = []
+    for i in range(6):
+        member = Member.objects.create(
+            **{**MEMBER, "first_name": f"Plip{i}"}, user=testuser, season=season
+        )
+        members.append(member)
+        if i:
+            member.waiting_courses.add(course)
+            WaitingList.objects.create(course=course, member=member)
+        else:
+            member.active_courses.add(course)
+    course = Course.objects.get(pk=course.pk)  # Dates, not datetimes
+    captured_queries: list[int] = []
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        _promote(course, 2, captured_queries)
+        _promote(course, 4, captured_queries)
+        # Nothing to do when full
+        _promote(course, 4, captured_queries)
+    assert captured_queries[0] == captured_queries[1]
+    assert captured_queries[2] < captured_queries[0]
+    assert len(callbacks) == 2
+    assert list(course.members.order_by("pk")) == members[:4]
+    assert list(course.members_waiting.order_by("pk")) == members[4:]
+    assert list(
+        WaitingList.objects.order_by("pk").values_list("member", flat=True)
+    ) == [member.pk for member in members[4:]]
+    assert len(mail.outbox) == 3
+    assert PaymentBalance.objects.get(payment__user=testuser).courses_count == 4
+
+
+@patch.object(Course, "update_queue", autospec=True)
+@pytest.mark.django_db
+def test_queue_updates_after_commit(update, django_capture_on_commit_callbacks):
+    gen_settings = GeneralSettings.get_solo()
+    gen_settings.allow_new_member = True
+    gen_settings.save()
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    courses = [
+        Course.objects.create(**{**COURSE, "name": f"Cours {i}"}, season=season)
+        for i in range(4)
+    ]
+    member = Member.objects.create(**MEMBER, user=testuser, season=season)
+    member.active_courses.add(*courses[:3])
+
+    def updated_courses(action) -> list[str]:
+        update.reset_mock()
+        with django_capture_on_commit_callbacks(execute=True):
+            action()
+        return sorted(call.args[0].name for call in update.call_args_list)
+
+    # Only courses losing a member, once per transaction
+    def remove():
+        with transaction.atomic():
+            member.active_courses.remove(courses[0])
+            member.active_courses.remove(courses[0])
+            member.active_courses.add(courses[3])
+
+    assert updated_courses(remove) == ["Cours 0"]
+    assert updated_courses(lambda: courses[3].members.remove(member)) == ["Cours 3"]
+    assert updated_courses(lambda: courses[2].save()) == ["Cours 2"]
+    assert updated_courses(member.active_courses.clear) == ["Cours 1", "Cours 2"]
+    member.active_courses.add(courses[1])
+    assert updated_courses(member.delete) == ["Cours 1"]
+    gen_settings.allow_new_member = False
+    gen_settings.save()
+    assert updated_courses(lambda: courses[2].save()) == []
+
+
+@patch.object(Course, "update_queue", autospec=True)
+@pytest.mark.django_db
+def test_queue_updates_rolled_back(update, django_capture_on_commit_callbacks):
+    gen_settings = GeneralSettings.get_solo()
+    gen_settings.allow_new_member = True
+    gen_settings.save()
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    course = Course.objects.create(**COURSE, season=season)
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            Course.objects.schedule_queue_update([course.pk])
+            raise ValueError
+    with django_capture_on_commit_callbacks(execute=True):
+        Course.objects.schedule_queue_update([])
+    assert not update.called
+
+
+@patch.object(Course, "update_queue", autospec=True)
+@pytest.mark.django_db(transaction=True)
+def test_queue_updates_autocommit(update):
+    gen_settings = GeneralSettings.get_solo()
+    gen_settings.allow_new_member = True
+    gen_settings.save()
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    course = Course.objects.create(**COURSE, season=season)
+    update.reset_mock()
+    Course.objects.schedule_queue_update([course.pk])
+    (call,) = update.call_args_list
+    assert call.args[0] == course
+    with transaction.atomic():
+        Course.objects.schedule_queue_update([course.pk])
+        assert update.call_count == 1
+    assert update.call_count == 2
+
+
+def _signup_rush(count: int, capacity: int, concurrent: bool) -> Course:
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    course = Course.objects.create(**COURSE, season=season, capacity=capacity)
+    members = [
+        Member.objects.create(
+            **{**MEMBER, "first_name": f"Plip{i}"}, user=testuser, season=season
+        )
+        for i in range(count)
+    ]
+    if not concurrent:
+        for member in members:
+            Course.objects.reserve_seats(member, [course])
+        return course
+    barrier = threading.Barrier(count)
+
+    def signup(member: Member) -> None:
+        try:
+            barrier.wait()
+            Course.objects.reserve_seats(member, [course])
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        list(executor.map(signup, members))
+    return course
+
+
+@pytest.mark.django_db
+def test_reserve_seats():
+    course = _signup_rush(20, 12, concurrent=False)
+    assert course.members.count() == 12
+    assert course.members_waiting.count() == 8
+    assert WaitingList.objects.filter(course=course).count() == 8
+    # Already seated members keep their seat
+    member = course.members.first()
+    assert Course.objects.reserve_seats(member, [course]) == ([course], [])
+    assert course.members.count() == 12
+
+
+@pytest.mark.django_db
+def test_taken_seats():
+    course = _signup_rush(2, 3, concurrent=False)
+    stale = Course.objects.get(pk=course.pk)
+    testuser = User.objects.get(username=TESTUSER)
+    member = Member.objects.create(**MEMBER, user=testuser, season=course.season)
+    Course.objects.reserve_seats(member, [course])
+    # Saving an instance loaded before the reservation keeps it
+    stale.name = "Renamed"
+    stale.save()
+    course = Course.objects.with_counts().get(pk=course.pk)
+    assert (course.name, course.taken, course.members_count) == ("Renamed", 3, 3)
+    assert course.is_complete
+    # Members of deleted users are kept, without their seats
+    testuser.delete()
+    course = Course.objects.with_counts().get(pk=course.pk)
+    assert (course.taken, course.members_count) == (0, 0)
+    assert not course.is_complete
+    assert not Course.objects.get(pk=course.pk).is_complete
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reserve_seats_concurrently():
+    course = _signup_rush(200, 12, concurrent=True)
+    assert course.members.count() == 12
+    course.refresh_from_db()
+    assert course.taken == 12
+    assert course.members_waiting.count() == 188
+    assert WaitingList.objects.filter(course=course).count() == 188
+
+
+@pytest.mark.django_db
+def test_payment_with_balance_matches_properties(django_assert_num_queries):
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    other_user = User.objects.create(username="other", email="other@kdance.com")
+    season = Season.objects.create(
+        **{**SEASON, "ffd_a_amount": 25}, year="1900-1901", pass_sport_amount=50
+    )
+    courses = [
+        Course.objects.create(
+            **{**COURSE, "name": f"Cours {i}", "price": 100 + i}, season=season
+        )
+        for i in range(3)
+    ]
+    members = []
+    for i, (active, cancelled, license) in enumerate(
+        [(courses[:2], [], 25), ([], [courses[2]], 0), ([], [], 25)]
+    ):
+        member = Member.objects.create(
+            **{**MEMBER, "first_name": f"Plip{i}"},
+            user=testuser,
+            season=season,
+            ffd_license=license,
+            cancel_refund=10.5 * i,
+        )
+        member.active_courses.add(*active)
+        member.cancelled_courses.add(*cancelled)
+        members.append(member)
+    members[0].sport_pass = SportPass.objects.create(code="pass")
+    members[0].save()
+    payment = Payment.objects.get(user=testuser, season=season)
+    payment.cash = 12.5
+    payment.special_discount = 7
+    payment.refund = 3
+    payment.other_payment = OtherPayment.objects.create(amount=4, comment="crypto")
+    payment.save()
+    Ancv.objects.create(amount=20, count=2, payment=payment)
+    SportCoupon.objects.create(amount=15, count=1, payment=payment)
+    CBPayment.objects.create(amount=30.5, payment=payment)
+    for i in range(2):
+        Check.objects.create(
+            number=i,
+            name="Bob",
+            bank="bank",
+            amount=40 + i,
+            month=i + 1,
+            payment=payment,
+        )
+
+    for pk in Payment.objects.filter(season=season).values_list("pk", flat=True):
+        expected = Payment.objects.get(pk=pk)
+        annotated = Payment.objects.with_balance().get(pk=pk)
+        assert annotated.due == expected.due
+        assert annotated.paid == pytest.approx(expected.paid)
+        assert annotated.due_detail == expected.due_detail
+        assert annotated.sport_pass_count == expected.sport_pass_count
+        assert annotated.sport_pass_amount == expected.sport_pass_amount
+        assert annotated.balance == pytest.approx(
+            annotated.due_amount - expected.paid + expected.refund
+        )
+    with django_assert_num_queries(1):
+        ordered = list(
+            Payment.objects.with_balance().filter(season=season).order_by("-balance")
+        )
+        assert [(p.user_id, p.due, p.paid) for p in ordered] == [
+            (testuser.pk, 269, 213),
+            (other_user.pk, 0, 0),
+        ]
+        assert len(ordered[0].due_detail) == 6
+
+
+@pytest.mark.django_db
+def test_payment_balance_kept_up_to_date():
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    course = Course.objects.create(**COURSE, season=season)
+    payment = Payment.objects.get(user=testuser, season=season)
+    ledger = payment.ledger
+    assert (ledger.due, ledger.paid, ledger.balance) == (0, 0, 0)
+
+    def assert_ledger(due, paid):
+        ledger = PaymentBalance.objects.get(payment=payment)
+        assert (ledger.due, ledger.paid) == (due, paid)
+        assert ledger.balance == due - paid + ledger.refund
+        assert not PaymentBalance.objects.drifted(Payment.objects.filter(pk=payment.pk))
+
+    member = Member.objects.create(**MEMBER, user=testuser, season=season)
+    member.active_courses.add(course)
+    assert_ledger(20, 0)
+    course.price = 30
+    course.save()
+    assert_ledger(40, 0)
+    check = Check.objects.create(
+        number=1, name="Bob", bank="bank", amount=15, month=1, payment=payment
+    )
+    assert_ledger(40, 15)
+    Ancv.objects.create(amount=5, count=1, payment=payment)
+    SportCoupon.objects.create(amount=5, count=1, payment=payment)
+    CBPayment.objects.create(amount=5, payment=payment)
+    assert_ledger(40, 30)
+    check.delete()
+    assert_ledger(40, 15)
+    member.sport_pass = SportPass.objects.create(code="pass")
+    member.save()
+    assert_ledger(40, 65)
+    member.sport_pass.delete()
+    assert_ledger(40, 15)
+    member.refresh_from_db()
+    member.cancelled_courses.add(course)
+    member.active_courses.remove(course)
+    member.cancel_refund = 10
+    member.save()
+    assert_ledger(20, 15)
+    course.members_cancelled.clear()
+    assert_ledger(-10, 15)
+    member.delete()
+    assert_ledger(0, 15)
+
+
+@parameterized.expand(["payment", "season", "user"])
+@pytest.mark.django_db(transaction=True)
+def test_delete_payment_with_checks(deleted):
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    course = Course.objects.create(**COURSE, season=season)
+    member = Member.objects.create(**MEMBER, user=testuser, season=season)
+    member.active_courses.add(course)
+    payment = Payment.objects.get(user=testuser, season=season)
+    Check.objects.create(
+        number=1, name="Bob", bank="bank", amount=15, month=1, payment=payment
+    )
+    CBPayment.objects.create(amount=5, payment=payment)
+    assert payment.ledger.paid == 20
+    {"payment": payment, "season": season, "user": testuser}[deleted].delete()
+    assert not Payment.objects.exists()
+    assert not PaymentBalance.objects.exists()
+
+
+@pytest.mark.django_db
+def test_payment_save_validates_members_in_bulk(django_assert_max_num_queries):
+    testuser = User.objects.create(username=TESTUSER, email=TESTUSER_EMAIL)
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    for i in range(5):
+        Member.objects.create(
+            **{**MEMBER, "first_name": f"Plip{i}"}, user=testuser, season=season
+        )
+    received = []
+    members_validated.connect(
+        lambda sender, **kwargs: received.append(kwargs), weak=False
+    )
+    payment = Payment.objects.get(user=testuser, season=season)
+    try:
+        with django_assert_max_num_queries(15):
+            payment.save()
+    finally:
+        members_validated.receivers.clear()
+    assert Member.objects.filter(is_validated=False).count() == 0
+    assert len(received) == 1
+    assert len(received[0]["member_ids"]) == 5
+    assert received[0]["payment"] == payment
+    assert PaymentBalance.objects.get(payment=payment).due == 50
+
+
+@pytest.mark.django_db
+def test_person_search_name():
+    contact = Contact.objects.create(
+        first_name="  Jean-éloi ",
+        last_name="LE  BŒUF",
+        email="jean@kdance.com",
+        phone="0123456789",
+        contact_type=Contact.ContactEnum.EMERGENCY,
+    )
+    contact.refresh_from_db()
+    assert contact.search_name == "jean-eloi le boeuf"
+    assert contact.search_name_reverse == "le boeuf jean-eloi"
+    contact.first_name = "Zoé"
+    contact.save(update_fields=["first_name"])
+    contact.refresh_from_db()
+    assert contact.search_name == "zoe le boeuf"
+    assert list(Contact.objects.filter(Contact.search_filter("LE BOEUF"))) == [contact]
+    assert list(Contact.objects.filter(Contact.search_filter("le bœ"))) == [contact]
+
+
+@pytest.mark.django_db
+def test_cached_settings_and_season(django_assert_num_queries):
+    season = Season.objects.create(**SEASON, year="1900-1901")
+    general_settings = GeneralSettings.get_solo()
+    with django_assert_num_queries(1):
+        assert Season.objects.current() == season
+        assert Season.objects.current() == season
+        assert GeneralSettings.get_solo() == general_settings
+    general_settings.allow_new_member = False
+    general_settings.save()
+    assert not GeneralSettings.get_solo().allow_new_member
+    new_season = Season.objects.create(**SEASON, year="1901-1902")
+    assert Season.objects.current() == new_season
+    with request_scope():
+        assert Season.objects.current() == new_season
+        assert not GeneralSettings.get_solo().allow_new_member
+        # Read once per request, even when the shared cache is emptied
+        cache.clear()
+        with django_assert_num_queries(0):
+            assert Season.objects.current() == new_season
+            assert not GeneralSettings.get_solo().allow_new_member
+        # Saving invalidates the request scope too
+        general_settings.allow_new_member = True
+        general_settings.save()
+        assert GeneralSettings.get_solo().allow_new_member
+    # Out of the request, the season is loaded again, the settings are cached
+    with django_assert_num_queries(1):
+        assert Season.objects.current() == new_season
+        assert GeneralSettings.get_solo().allow_new_member
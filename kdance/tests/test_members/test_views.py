@@ -3,7 +3,9 @@
 from typing import Callable
 
 import pytest
+from django.db import connection
 from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from parameterized import parameterized
 
@@ -63,6 +65,18 @@ class TestIndexView(MembersViewsTestCase):
     view_function = index
     ADMIN_ONLY = False
 
+    def test_cached_lookups(self):
+        settings_lookup = 'FROM "members_generalsettings"'
+        season_lookup = 'AND "members_season"."is_current")'
+        with AuthenticatedAction(self.client, self.testuser):
+            for expected in (1, 0):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(self.view_url)
+                assert response.status_code == 200
+                for lookup in (settings_lookup, season_lookup):
+                    count = sum(lookup in query["sql"] for query in queries)
+                    assert count == expected, lookup
+
 
 class TestMemberView(MembersViewsTestCase):
     __test__ = True